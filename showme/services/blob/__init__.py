@@ -2,3 +2,6 @@
 
 from .base import *  # noqa
 from .exceptions import *  # noqa
+from .local import *  # noqa
+from .manifest import *  # noqa
+from .uploads import *  # noqa
@@ -1,87 +1,435 @@
-from azure.storage.blob import BlobServiceClient, ContainerClient
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, NamedTuple
+from urllib.parse import quote, urlparse
+
+import aiohttp
+from azure.core.exceptions import (
+    AzureError,
+    ResourceExistsError,
+    ResourceNotFoundError,
+)
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob import BlobSasPermissions, ContentSettings, generate_blob_sas
+from azure.storage.blob.aio import (
+    BlobClient,
+    BlobServiceClient,
+    ContainerClient,
+)
 from io import BytesIO
+from pathlib import Path
 from loguru import logger
 
+from .manifest import BlobManifest
+
+# Blob clients kept for reuse, by blob name.
+DEFAULT_BLOB_CLIENTS = 1024
+# Connections kept open to the storage account.
+DEFAULT_MAX_CONNECTIONS = 64
+# Requests sent to the storage account at once.
+DEFAULT_MAX_CONCURRENCY = 32
+# Bytes downloaded per request, and so per chunk of the streamed blobs.
+DEFAULT_CHUNK_SIZE = 256 * 1024
+# Tolerated clock skew between us and the storage account, for SAS tokens.
+SAS_CLOCK_SKEW = timedelta(minutes=5)
+
+
+class BlobStream(NamedTuple):
+    """A stored image being read chunk by chunk."""
+
+    size: int
+    chunks: AsyncIterator[bytes]
+    # MD5 digest of the whole image, if the backend keeps it.
+    content_md5: bytes | None = None
+
+
+class BaseImageStorage(ABC):
+    """
+    Asynchronous storage of the rendered images, by name.
+
+    Backends may keep a manifest of the stored names, answering existence
+    checks locally, and may expose the files the images are stored in,
+    so they can be sent without being read.
+    """
+
+    manifest: BlobManifest | None = None
+
+    @abstractmethod
+    async def image_exists(self, blob_name) -> bool:
+        """Check if the specified image is stored."""
+
+    @abstractmethod
+    async def upload_image_if_not_exists(self, blob_name, bytes_io: BytesIO) -> bool:
+        """
+        Store an image, unless one is already stored under the same name.
+
+        Returns:
+        - True if the image was stored, False if it already was.
+        """
+
+    @abstractmethod
+    async def delete_image(self, blob_name) -> bool:
+        """
+        Returns:
+        - True if the image was deleted, False if it wasn't stored.
+        """
+
+    @abstractmethod
+    async def download_image(self, blob_name) -> BytesIO | None:
+        """
+        Returns:
+        - A BytesIO object containing the image data, or None if it isn't stored.
+        """
+
+    @abstractmethod
+    async def stream_image(self, blob_name) -> BlobStream | None:
+        """
+        Reads the specified image chunk by chunk.
+
+        Returns:
+        - The image's stream, or None if it isn't stored.
+        """
+
+    @abstractmethod
+    def get_image_url(self, blob_name, sas_ttl: int | None = None) -> str:
+        """
+        Get the URL the specified image is served at.
+
+        Parameters:
+        - blob_name: The name of the image.
+        - sas_ttl: Seconds the URL stays valid for, for backends signing their URLs.
+        """
+
+    async def get_image_path(self, blob_name) -> Path | None:
+        """
+        Returns:
+        - The file the image is stored in, None if it isn't stored in a local file.
+        """
+        return None
+
+    async def get_image_md5(self, blob_name) -> bytes | None:
+        """
+        Get the MD5 digest of the specified image, without downloading it
+        from backends keeping it along with the image.
+
+        Returns:
+        - The image's digest, None if it isn't stored or its digest isn't known.
+        """
+        return None
+
+    async def get_image(self, blob_name) -> BytesIO:
+        """
+        Get the image data of the specified image.
+
+        Parameters:
+        - blob_name: The name of the image to retrieve.
+
+        Returns:
+        - A BytesIO object containing the image data.
+
+        Raises:
+        - FileNotFoundError: If the image isn't stored.
+        """
+        image = await self.download_image(blob_name)
+        if image is None:
+            raise FileNotFoundError(
+                f"Image '{blob_name}' not found.",
+            )
+        return image
+
+    async def refresh_manifest(self):
+        """Reloads the manifest of the stored names, for backends keeping one."""
+
+    async def run_manifest_refresh(self, interval: float):
+        """
+        Refreshes the manifest every interval seconds, until cancelled.
+
+        A failed refresh leaves the manifest as it was until the next one.
+
+        Parameters:
+        - interval: Seconds between two refreshes.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh_manifest()
+            except AzureError as exc:
+                logger.warning(f"Blob manifest refresh failed: {exc}")
+            except Exception:
+                logger.exception("Blob manifest refresh failed")
+
+    async def close(self):
+        """Releases the backend's resources."""
+
+
+def parse_connection_string(connection_string: str) -> dict[str, str]:
+    """Settings of an Azure Storage connection string, by lowercase name."""
+    connection = {}
+    for setting in connection_string.split(";"):
+        name, _, value = setting.partition("=")
+        if name.strip():
+            connection[name.strip().lower()] = value.strip()
+    return connection
+
 
 class SecureBlobMixin:
-    blob_service_client: BlobServiceClient
+    connection_string: str
 
     def __init__(self, connection_string: str):
         """- connection_string: The connection string to the Azure Blob Storage account."""
-        self.blob_service_client: BlobServiceClient = (
-            BlobServiceClient.from_connection_string(
-                connection_string,
-            )
+        self.connection_string = connection_string
+
+    def create_blob_service_client(self, **kwargs) -> BlobServiceClient:
+        """Creates an asynchronous client of the storage account."""
+        return BlobServiceClient.from_connection_string(
+            self.connection_string,
+            **kwargs,
         )
 
 
-class ImageStorageService(SecureBlobMixin):
+class ImageStorageService(SecureBlobMixin, BaseImageStorage):
+    """
+    Asynchronous storage of the images in an Azure Blob Storage container.
+
+    Requests go through a pool of kept-alive connections, bounded in size,
+    and at most max_concurrency of them are in flight at once. The clients
+    are bound to the event loop they're created in, so they're created on
+    first use and again if the loop changes.
+    """
+
     container_client: ContainerClient
     container_name: str
 
-    def __init__(self, connection_string: str, container_name: str):
-        """- connection_string: The connection string to the Azure Blob Storage account."""
+    def __init__(
+        self,
+        connection_string: str,
+        container_name: str,
+        max_blob_clients: int = DEFAULT_BLOB_CLIENTS,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        """
+        - connection_string: The connection string to the Azure Blob Storage account.
+        - container_name: The container the images are stored in.
+        - max_blob_clients: Blob clients kept for reuse.
+        - max_connections: Connections kept open to the storage account.
+        - max_concurrency: Requests sent to the storage account at once.
+        - chunk_size: Bytes downloaded per request, and so per chunk of the streamed blobs.
+        """
         super().__init__(connection_string)
-        self._ensure_container_exists(container_name)
+        self.container_name = container_name
+        connection = parse_connection_string(connection_string)
+        blob_endpoint = connection.get("blobendpoint")
+        if blob_endpoint is None:
+            blob_endpoint = "{0}://{1}.blob.{2}".format(
+                connection.get("defaultendpointsprotocol", "https"),
+                connection.get("accountname"),
+                connection.get("endpointsuffix", "core.windows.net"),
+            )
+        self.account_name = connection.get(
+            "accountname",
+            urlparse(blob_endpoint).hostname.split(".")[0],
+        )
+        self.account_key = connection.get("accountkey")
+        self.container_url = f"{blob_endpoint.rstrip('/')}/{quote(container_name)}"
+        self.max_blob_clients = max_blob_clients
+        self.max_connections = max_connections
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
+        self.manifest = BlobManifest()
+        self._blob_clients: OrderedDict[str, BlobClient] = OrderedDict()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._container_lock: asyncio.Lock | None = None
+        self._container_checked = False
+
+    async def _connect(self):
+        """
+        Creates the clients and their connection pool in the running loop,
+        closing the ones of the previous loop.
+
+        The clients are only used once they're all created, so a failure
+        leaves the service to connect again on the next request.
+        """
+        previous = self._detach_clients()
+        try:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    ttl_dns_cache=300,
+                ),
+            )
+            try:
+                blob_service_client = self.create_blob_service_client(
+                    transport=AioHttpTransport(session=session, session_owner=False),
+                    max_single_get_size=self.chunk_size,
+                    max_chunk_get_size=self.chunk_size,
+                )
+                container_client = blob_service_client.get_container_client(
+                    self.container_name,
+                )
+            except Exception:
+                await session.close()
+                raise
+            self.blob_service_client = blob_service_client
+            self.container_client = container_client
+            self._session = session
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._container_lock = asyncio.Lock()
+            self._loop = asyncio.get_running_loop()
+        finally:
+            if previous is not None:
+                await self._release_clients(*previous)
 
-    def _ensure_container_exists(self, container_name):
+    async def close(self):
+        """
+        Closes the clients and their connections.
+
+        Clients of another loop still running are closed in that loop,
+        those of a closed loop have no connections left to close.
+        """
+        clients = self._detach_clients()
+        if clients is not None:
+            await self._release_clients(*clients)
+
+    def _detach_clients(
+        self,
+    ) -> (
+        tuple[asyncio.AbstractEventLoop, aiohttp.ClientSession, BlobServiceClient]
+        | None
+    ):
+        """Forgets the clients, returning them to be closed, if there are any."""
+        if self._session is None:
+            return None
+        clients = self._loop, self._session, self.blob_service_client
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+        self._container_lock = None
+        self._blob_clients.clear()
+        return clients
+
+    async def _release_clients(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        session: aiohttp.ClientSession,
+        blob_service_client: BlobServiceClient,
+    ):
+        closing = self._close_clients(session, blob_service_client)
+        if loop is asyncio.get_running_loop() or loop.is_closed():
+            await closing
+        else:
+            asyncio.run_coroutine_threadsafe(closing, loop)
+
+    @staticmethod
+    async def _close_clients(
+        session: aiohttp.ClientSession,
+        blob_service_client: BlobServiceClient,
+    ):
+        await blob_service_client.close()
+        await session.close()
+
+    async def _ensure_container_exists(self):
         """
         Checks if the specified container exists, and creates it if not.
+
+        Checked once, before the first request goes through, and again
+        on the next request if the check fails.
         """
-        container_client = self.blob_service_client.get_container_client(
-            container_name,
-        )
+        async with self._container_lock:
+            if self._container_checked:
+                return
+            try:
+                await self.container_client.create_container()
+                logger.info(f"Container '{self.container_name}' was created.")
+            except ResourceExistsError:
+                logger.info(f"Container '{self.container_name}' already exists.")
+            self._container_checked = True
 
-        if not container_client.exists():
-            container_client.create_container()
-            logger.info(f"Container '{container_name}' was created.")
+    @asynccontextmanager
+    async def _request(self) -> AsyncIterator[None]:
+        if self._loop is not asyncio.get_running_loop():
+            await self._connect()
+        if not self._container_checked:
+            await self._ensure_container_exists()
+        async with self._semaphore:
+            yield
+
+    def get_blob_client(self, blob_name) -> BlobClient:
+        """
+        Client of the specified blob, reused across the calls on the same blob.
+        """
+        blob_client = self._blob_clients.get(blob_name)
+        if blob_client is None:
+            blob_client = self.container_client.get_blob_client(blob_name)
+            self._blob_clients[blob_name] = blob_client
+            if len(self._blob_clients) > self.max_blob_clients:
+                self._blob_clients.popitem(last=False)
         else:
-            logger.info(f"Container '{container_name}' already exists.")
-        self.container_name = container_name
-        self.container_client = container_client
+            self._blob_clients.move_to_end(blob_name)
+        return blob_client
 
-    def image_exists(self, blob_name):
+    async def image_exists(self, blob_name):
         """
         Check if the specified blob exists in the container.
 
+        Answered by the manifest once it's loaded, without a request.
+
         Parameters:
         - blob_name: The name of the blob to check.
 
         Returns:
         - True if the blob exists, False otherwise.
         """
-        blob_client = self.blob_service_client.get_blob_client(
-            container=self.container_name,
-            blob=blob_name,
-        )
-        return blob_client.exists()
+        exists = self.manifest.get(blob_name)
+        if exists is None:
+            async with self._request():
+                exists = await self.get_blob_client(blob_name).exists()
+        return exists
 
-    def upload_image_if_not_exists(self, blob_name, bytes_io: BytesIO) -> bool:
+    async def upload_image_if_not_exists(self, blob_name, bytes_io: BytesIO) -> bool:
         """
-        Check if a PNG image exists in the specified Azure Blob Storage container and if not, upload it from a BytesIO object.
+        Upload a PNG image from a BytesIO object, unless it already exists in the container.
+
+        Without overwrite, the upload is conditioned on the blob not existing
+        (If-None-Match: *), so checking and uploading take a single request and can't race.
+        The image's MD5 digest is stored along with it.
 
         Parameters:
         - blob_name: The desired name of the PNG file in the Blob Storage.
         - bytes_io: A BytesIO object containing the PNG data to be uploaded.
 
         Returns:
-        - True if the file was uploaded successfully, False if the file already exists or an error occurred.
+        - True if the file was uploaded successfully, False if the file already exists.
         """
-        if self.image_exists(blob_name):
+        image_data = bytes_io.getvalue()
+        try:
+            async with self._request():
+                await self.get_blob_client(blob_name).upload_blob(
+                    image_data,
+                    blob_type="BlockBlob",
+                    overwrite=False,
+                    content_settings=ContentSettings(
+                        content_type="image/png",
+                        content_md5=hashlib.md5(
+                            image_data,
+                            usedforsecurity=False,
+                        ).digest(),
+                    ),
+                )
+        except ResourceExistsError:
+            self.manifest.add(blob_name)
             return False
-        blob_client = self.blob_service_client.get_blob_client(
-            container=self.container_name,
-            blob=blob_name,
-        )
-        bytes_io.seek(0)
-        blob_client.upload_blob(
-            bytes_io,
-            blob_type="BlockBlob",
-            overwrite=True,
-        )
+        self.manifest.add(blob_name)
         return True
 
-    def delete_image(self, blob_name):
+    async def delete_image(self, blob_name):
         """
         Delete the specified blob from the container.
 
@@ -91,19 +439,21 @@ class ImageStorageService(SecureBlobMixin):
         Returns:
         - True if the blob was deleted successfully, False if the blob does not exist.
         """
-        if not self.image_exists(blob_name):
+        try:
+            async with self._request():
+                await self.get_blob_client(blob_name).delete_blob()
+        except ResourceNotFoundError:
+            self.manifest.discard(blob_name)
             return False
-
-        blob_client = self.blob_service_client.get_blob_client(
-            container=self.container_name,
-            blob=blob_name,
-        )
-        blob_client.delete_blob()
+        self.manifest.discard(blob_name)
         return True
 
-    def get_image(self, blob_name) -> BytesIO:
+    async def download_image(self, blob_name) -> BytesIO | None:
         """
-        Get the image data from the specified blob in the container.
+        Download the image data from the specified blob in a single request.
+
+        The manifest isn't trusted to skip it: another process may have
+        uploaded the blob since the manifest was loaded.
 
         Parameters:
         - blob_name: The name of the blob to retrieve.
@@ -111,31 +461,104 @@ class ImageStorageService(SecureBlobMixin):
         Returns:
         - A BytesIO object containing the image data, or None if the blob does not exist.
         """
+        try:
+            async with self._request():
+                downloader = await self.get_blob_client(blob_name).download_blob()
+                image_data = await downloader.readall()
+        except ResourceNotFoundError:
+            self.manifest.discard(blob_name)
+            return None
+        self.manifest.add(blob_name)
+        return BytesIO(image_data)
+
+    async def stream_image(self, blob_name) -> BlobStream | None:
+        """
+        Start downloading the specified blob, to be read chunk by chunk.
 
-        if not self.image_exists(blob_name):
-            raise FileNotFoundError(
-                f"Blob '{blob_name}' not found in container '{self.container_name}'.",
-            )
+        Only the first chunk is downloaded here, the next ones as they're iterated over.
 
-        blob_client = self.blob_service_client.get_blob_client(
-            container=self.container_name,
-            blob=blob_name,
+        Parameters:
+        - blob_name: The name of the blob to retrieve.
+
+        Returns:
+        - The blob's stream, or None if the blob does not exist.
+        """
+        try:
+            async with self._request():
+                downloader = await self.get_blob_client(blob_name).download_blob()
+        except ResourceNotFoundError:
+            self.manifest.discard(blob_name)
+            return None
+        self.manifest.add(blob_name)
+        return BlobStream(
+            downloader.size,
+            downloader.chunks(),
+            downloader.properties.content_settings.content_md5,
         )
-        image_data = blob_client.download_blob().readall()
-        return BytesIO(image_data)
 
-    def get_image_url(self, blob_name) -> str:
+    async def get_image_md5(self, blob_name) -> bytes | None:
+        """
+        Get the Content-MD5 of the specified blob, out of its properties alone.
+
+        Parameters:
+        - blob_name: The name of the blob.
+
+        Returns:
+        - The blob's MD5 digest, None if the blob does not exist or has none.
+        """
+        try:
+            async with self._request():
+                properties = await self.get_blob_client(blob_name).get_blob_properties()
+        except ResourceNotFoundError:
+            self.manifest.discard(blob_name)
+            return None
+        content_md5 = properties.content_settings.content_md5
+        return content_md5 and bytes(content_md5)
+
+    def get_image_url(self, blob_name, sas_ttl: int | None = None) -> str:
         """
         Get the URL of the specified blob in the container.
 
         Parameters:
         - blob_name: The name of the blob to retrieve.
+        - sas_ttl: Seconds the URL stays valid for, signed with a read-only SAS token.
+            None for the plain URL, as do storage accounts connected without their key.
 
         Returns:
         - A string containing the URL of the blob.
         """
-        blob_client = self.blob_service_client.get_blob_client(
-            container=self.container_name,
-            blob=blob_name,
+        url = f"{self.container_url}/{quote(blob_name)}"
+        if sas_ttl is None or self.account_key is None:
+            return url
+        now = datetime.now(timezone.utc)
+        sas_token = generate_blob_sas(
+            self.account_name,
+            self.container_name,
+            blob_name,
+            account_key=self.account_key,
+            permission=BlobSasPermissions(read=True),
+            start=now - SAS_CLOCK_SKEW,
+            expiry=now + timedelta(seconds=sas_ttl),
         )
-        return blob_client.url
+        return f"{url}?{sas_token}"
+
+    async def refresh_manifest(self):
+        """
+        Lists the container, one page of names per request, into the manifest.
+
+        The whole container is listed every time: the storage can't list
+        only the blobs changed since a given time without its change feed,
+        and a full listing also catches the blobs deleted by the others.
+        """
+
+        async def list_names() -> list[str]:
+            async with self._request():
+                return [
+                    name
+                    async for name in self.container_client.list_blob_names(
+                        results_per_page=5000,
+                    )
+                ]
+
+        await self.manifest.refresh(list_names)
+        logger.info(f"Blob manifest refreshed with {len(self.manifest)} blobs.")
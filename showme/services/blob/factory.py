@@ -0,0 +1,25 @@
+from showme.settings import StorageBackend, settings
+
+from .base import BaseImageStorage, ImageStorageService
+from .local import LocalImageStorage
+
+
+def build_storage_service() -> BaseImageStorage:
+    """
+    Creates the images storage of the configured backend.
+
+    :return: storage service.
+    """
+    if settings.storage_backend == StorageBackend.LOCAL:
+        return LocalImageStorage(
+            settings.local_storage_path,
+            settings.local_storage_url,
+            settings.azure_blob_chunk_size,
+        )
+    return ImageStorageService(
+        settings.azure_blob_connection_string,
+        settings.azure_blob_container_name,
+        max_connections=settings.azure_blob_max_connections,
+        max_concurrency=settings.azure_blob_max_concurrency,
+        chunk_size=settings.azure_blob_chunk_size,
+    )
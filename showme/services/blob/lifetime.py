@@ -0,0 +1,95 @@
+import asyncio
+
+from azure.core.exceptions import AzureError
+from fastapi import FastAPI
+from loguru import logger
+
+from showme.services.blob import BaseImageStorage, UploadQueue
+from showme.settings import settings
+
+
+async def start_blob_manifest(
+    storage_service: BaseImageStorage,
+) -> asyncio.Task | None:  # pragma: no cover
+    """
+    Loads the storage's blob manifest and keeps it fresh in the background.
+
+    When the first listing fails, the blobs are checked over the network
+    until a later refresh succeeds.
+
+    :param storage_service: storage service the manifest belongs to.
+    :return: the refreshing task, None without a manifest.
+    """
+    if storage_service.manifest is None or not settings.azure_blob_manifest_enabled:
+        return None
+    try:
+        await storage_service.refresh_manifest()
+    except AzureError as exc:
+        logger.warning(f"Blob manifest couldn't be loaded: {exc}")
+    return asyncio.create_task(
+        storage_service.run_manifest_refresh(
+            settings.azure_blob_manifest_refresh_interval,
+        ),
+    )
+
+
+async def init_blob_manifest(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Loads the blob manifest of the image service's storage.
+
+    :param app: current application.
+    """
+    app.state.blob_manifest_task = await start_blob_manifest(
+        app.state.image_service.storage_service,
+    )
+
+
+async def shutdown_blob_manifest(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Stops refreshing the blob manifest.
+
+    :param app: current application.
+    """
+    if app.state.blob_manifest_task is not None:
+        app.state.blob_manifest_task.cancel()
+
+
+async def shutdown_storage(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Closes the connections of the image service's storage.
+
+    :param app: current application.
+    """
+    await app.state.image_service.storage_service.close()
+
+
+async def init_upload_queue(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Starts persisting the image service's renders in the background.
+
+    :param app: current application.
+    """
+    app.state.upload_queue = None
+    if settings.image_upload_queue_size <= 0:
+        return
+    upload_queue = UploadQueue(
+        app.state.image_service.storage_service,
+        settings.image_upload_queue_size,
+        settings.image_upload_workers,
+        settings.image_upload_max_retries,
+        settings.image_upload_retry_backoff,
+    )
+    upload_queue.start()
+    app.state.upload_queue = upload_queue
+    app.state.image_service.upload_queue = upload_queue
+
+
+async def shutdown_upload_queue(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Waits for the queued renders to be persisted.
+
+    :param app: current application.
+    """
+    if app.state.upload_queue is not None:
+        app.state.image_service.upload_queue = None
+        await app.state.upload_queue.drain(settings.image_upload_drain_timeout)
@@ -0,0 +1,120 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from io import BytesIO
+from pathlib import Path
+from typing import AsyncIterator
+from urllib.parse import quote
+
+from .base import BaseImageStorage, BlobStream
+
+# Bytes read per chunk of the streamed images.
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+
+class LocalImageStorage(BaseImageStorage):
+    """
+    Storage of the images in a local directory.
+
+    Images are spread over two levels of subdirectories picked from the hash
+    of their name, keeping directories small. They're written to a temporary
+    file first, then linked to their final name in a single atomic step that
+    fails if the name is taken, so readers never see a partial image and
+    concurrent writers never overwrite each other.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        base_url: str = "/images",
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        """
+        - root: The directory the images are stored in.
+        - base_url: URL the directory is served at.
+        - chunk_size: Bytes read per chunk of the streamed images.
+        """
+        self.root = Path(root)
+        self.base_url = base_url.rstrip("/")
+        self.chunk_size = chunk_size
+
+    def get_relative_path(self, blob_name) -> Path:
+        """Path of an image's file, relative to the root directory."""
+        shard = hashlib.blake2b(blob_name.encode(), digest_size=2).hexdigest()
+        return Path(shard[:2], shard[2:], blob_name)
+
+    def get_path(self, blob_name) -> Path:
+        """Path of an image's file."""
+        return self.root / self.get_relative_path(blob_name)
+
+    async def image_exists(self, blob_name) -> bool:
+        return await asyncio.to_thread(self.get_path(blob_name).is_file)
+
+    async def upload_image_if_not_exists(self, blob_name, bytes_io: BytesIO) -> bool:
+        return await asyncio.to_thread(self._write, blob_name, bytes_io.getvalue())
+
+    async def delete_image(self, blob_name) -> bool:
+        try:
+            await asyncio.to_thread(self.get_path(blob_name).unlink)
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def download_image(self, blob_name) -> BytesIO | None:
+        try:
+            image_data = await asyncio.to_thread(self.get_path(blob_name).read_bytes)
+        except FileNotFoundError:
+            return None
+        return BytesIO(image_data)
+
+    async def stream_image(self, blob_name) -> BlobStream | None:
+        try:
+            file = await asyncio.to_thread(self.get_path(blob_name).open, "rb")
+        except FileNotFoundError:
+            return None
+        size = os.fstat(file.fileno()).st_size
+
+        async def chunks() -> AsyncIterator[bytes]:
+            try:
+                while chunk := await asyncio.to_thread(file.read, self.chunk_size):
+                    yield chunk
+            finally:
+                file.close()
+
+        return BlobStream(size, chunks())
+
+    def get_image_url(self, blob_name, sas_ttl: int | None = None) -> str:
+        """URLs aren't signed, sas_ttl is ignored."""
+        return f"{self.base_url}/{quote(self.get_relative_path(blob_name).as_posix())}"
+
+    async def get_image_path(self, blob_name) -> Path | None:
+        path = self.get_path(blob_name)
+        if not await asyncio.to_thread(path.is_file):
+            return None
+        return path
+
+    async def get_image_md5(self, blob_name) -> bytes | None:
+        """Hashes the image's file, the digest isn't stored apart from it."""
+        try:
+            return await asyncio.to_thread(self._hash, blob_name)
+        except FileNotFoundError:
+            return None
+
+    def _hash(self, blob_name) -> bytes:
+        with self.get_path(blob_name).open("rb") as file:
+            return hashlib.file_digest(file, "md5").digest()
+
+    def _write(self, blob_name, image_data: bytes) -> bool:
+        path = self.get_path(blob_name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(image_data)
+            os.link(temp_path, path)
+        except FileExistsError:
+            return False
+        finally:
+            os.unlink(temp_path)
+        return True
@@ -0,0 +1,74 @@
+import threading
+import time
+from typing import Awaitable, Callable, Iterable
+
+
+class BlobManifest:
+    """
+    Local copy of the names of the blobs in a container.
+
+    Once loaded from a listing of the container, it answers existence checks,
+    misses included, without a request. Uploads and deletions are applied to it
+    as they happen, and periodic listings pick up the other processes' changes.
+    Until it's loaded, it doesn't know about any blob.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.refreshed_at: float | None = None
+        self._names: set[str] = set()
+        self._changes: dict[str, bool] | None = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def get(self, name: str) -> bool | None:
+        """
+        Returns:
+        - Whether the blob exists, None if the manifest isn't loaded yet.
+        """
+        if not self.loaded:
+            return None
+        return name in self._names
+
+    def add(self, name: str):
+        self._apply(name, True)
+
+    def discard(self, name: str):
+        self._apply(name, False)
+
+    async def refresh(self, list_names: Callable[[], Awaitable[Iterable[str]]]):
+        """
+        Replaces the manifest with a fresh listing of the container.
+
+        Changes applied while the listing runs are kept, as it may have missed them.
+
+        Parameters:
+        - list_names: Lists the names of the blobs in the container.
+        """
+        with self._lock:
+            self._changes = {}
+        try:
+            names = set(await list_names())
+        finally:
+            with self._lock:
+                changes, self._changes = self._changes, None
+        with self._lock:
+            for name, exists in changes.items():
+                if exists:
+                    names.add(name)
+                else:
+                    names.discard(name)
+            self._names = names
+            self.loaded = True
+            self.refreshed_at = time.monotonic()
+
+    def _apply(self, name: str, exists: bool):
+        with self._lock:
+            if exists:
+                self._names.add(name)
+            else:
+                self._names.discard(name)
+            if self._changes is not None:
+                self._changes[name] = exists
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from io import BytesIO
+
+from azure.core.exceptions import AzureError
+from loguru import logger
+from prometheus_client import Counter, Gauge, Histogram
+
+from .base import BaseImageStorage
+
+UPLOAD_QUEUE_DEPTH = Gauge(
+    "showme_upload_queue_depth",
+    "Images waiting to be uploaded.",
+    multiprocess_mode="livesum",
+)
+UPLOAD_FAILURES = Counter(
+    "showme_upload_failures",
+    "Uploads given up on, after all their retries for the transient errors.",
+)
+UPLOADS_INLINE = Counter(
+    "showme_uploads_inline",
+    "Uploads done by the caller because the queue was full.",
+)
+# Errors worth retrying an upload after, any other one fails it right away.
+TRANSIENT_UPLOAD_ERRORS = (AzureError, asyncio.TimeoutError, ConnectionError)
+
+UPLOAD_LAG_SECONDS = Histogram(
+    "showme_upload_lag_seconds",
+    "Time between an image being queued and it being persisted.",
+)
+
+
+class UploadQueue:
+    """
+    Bounded queue persisting images to the storage in the background.
+
+    Callers hand their images over and move on, while workers upload them,
+    retrying failed uploads with an exponential backoff. Queued images can
+    still be read from here until they're persisted.
+    """
+
+    def __init__(
+        self,
+        storage_service: BaseImageStorage,
+        max_size: int = 256,
+        workers: int = 4,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+    ):
+        """
+        - storage_service: The storage the images are uploaded to.
+        - max_size: Images allowed to wait for their upload.
+        - workers: Uploads running at once.
+        - max_retries: Retries of a failed upload before giving up on it.
+        - retry_backoff: Seconds before the first retry, doubling with each retry.
+        """
+        self.storage_service = storage_service
+        self.max_size = max_size
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.pending: dict[str, bytes] = {}
+        self._queue: asyncio.Queue[tuple[str, bytes, float]] | None = None
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        """Starts the upload workers in the running loop."""
+        self._queue = asyncio.Queue(self.max_size)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def submit(self, blob_name: str, image: bytes) -> bool:
+        """
+        Queues an image for upload, unless the queue is full or not started.
+
+        Returns:
+        - True if the image was queued, False if the caller must upload it.
+        """
+        if self._queue is None:
+            return False
+        if blob_name in self.pending:
+            return True
+        try:
+            self._queue.put_nowait((blob_name, image, time.monotonic()))
+        except asyncio.QueueFull:
+            UPLOADS_INLINE.inc()
+            return False
+        self.pending[blob_name] = image
+        UPLOAD_QUEUE_DEPTH.inc()
+        return True
+
+    async def drain(self, timeout: float | None = None):
+        """
+        Waits for the queued images to be uploaded, then stops the workers.
+
+        Parameters:
+        - timeout: Maximum seconds to wait, images still queued after it are lost.
+        """
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"{len(self.pending)} queued uploads were dropped.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._queue = None
+
+    async def _work(self):
+        while True:
+            blob_name, image, queued_at = await self._queue.get()
+            try:
+                if await self._upload(blob_name, image):
+                    UPLOAD_LAG_SECONDS.observe(time.monotonic() - queued_at)
+            except Exception as exc:
+                # The worker must outlive any upload, or the queue stalls.
+                UPLOAD_FAILURES.inc()
+                logger.exception(f"Uploading {blob_name} failed: {exc}")
+            finally:
+                self.pending.pop(blob_name, None)
+                UPLOAD_QUEUE_DEPTH.dec()
+                self._queue.task_done()
+
+    async def _upload(self, blob_name: str, image: bytes) -> bool:
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.storage_service.upload_image_if_not_exists(
+                    blob_name,
+                    BytesIO(image),
+                )
+                return True
+            except TRANSIENT_UPLOAD_ERRORS as exc:
+                if attempt == self.max_retries:
+                    UPLOAD_FAILURES.inc()
+                    logger.error(f"Uploading {blob_name} failed: {exc}")
+                    return False
+                await asyncio.sleep(self.retry_backoff * 2**attempt)
+        return False
@@ -0,0 +1,5 @@
+"""Cache service."""
+
+from .base import *  # noqa
+from .redis import *  # noqa
+from .singleflight import *  # noqa
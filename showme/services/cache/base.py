@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class LRUBytesCache:
+    """
+    Thread-safe in-memory LRU cache of byte strings, bounded by their total size.
+
+    Entries can optionally expire after a TTL. Hits, misses and evictions
+    are counted so the cache's efficiency can be monitored.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float | None = None):
+        """
+        - max_bytes: The byte budget shared by all the cached values.
+        - ttl: Seconds an entry stays valid, None to keep entries until evicted.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Hashable, tuple[bytes, float | None]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> bytes | None:
+        """
+        Get a cached value and mark it as the most recently used.
+
+        Returns:
+        - The cached bytes, or None if the key is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._is_expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: bytes) -> bool:
+        """
+        Cache a value, evicting the least recently used entries to make room.
+
+        Returns:
+        - True if the value was cached, False if it doesn't fit in the budget.
+        """
+        if len(value) > self.max_bytes:
+            return False
+        expires_at = None if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self.size + len(value) > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (value, expires_at)
+            self.size += len(value)
+        return True
+
+    def delete(self, key: Hashable) -> bool:
+        """
+        Drop a value from the cache.
+
+        Returns:
+        - True if the key was cached, False otherwise.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def clear(self) -> None:
+        """Drop every cached value."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        """Counters describing the cache's content and efficiency."""
+        return {
+            "entries": len(self._entries),
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _is_expired(self, entry: tuple[bytes, float | None]) -> bool:
+        expires_at = entry[1]
+        return expires_at is not None and expires_at < time.monotonic()
+
+    def _remove(self, key: Hashable) -> None:
+        value, _ = self._entries.pop(key)
+        self.size -= len(value)
@@ -0,0 +1,15 @@
+from fastapi import FastAPI
+
+from showme.services.image.factory import build_shared_image_cache
+
+
+def init_shared_image_cache(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Hands the image service the rendered images cache shared
+    with the other processes in redis.
+
+    :param app: current application.
+    """
+    app.state.image_service.shared_cache = build_shared_image_cache(
+        app.state.redis_pool,
+    )
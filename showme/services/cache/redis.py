@@ -0,0 +1,100 @@
+from loguru import logger
+from redis.asyncio import ConnectionPool, Redis
+from redis.exceptions import RedisError
+
+
+class RedisBytesCache:
+    """
+    Cache of byte strings in Redis, shared by every process connected to it.
+
+    Entries expire after a TTL and values over a size limit aren't cached.
+    Redis being unavailable degrades to cache misses rather than errors.
+    """
+
+    def __init__(
+        self,
+        redis_pool: ConnectionPool,
+        ttl: int | None = 3600,
+        max_value_bytes: int = 1024 * 1024,
+        prefix: str = "showme:img:",
+    ):
+        """
+        - redis_pool: The Redis connection pool.
+        - ttl: Seconds an entry stays cached, None to rely on Redis' eviction policy.
+        - max_value_bytes: Size above which values aren't cached.
+        - prefix: Prefix of the entries' keys.
+        """
+        self.redis_pool = redis_pool
+        self.ttl = ttl
+        self.max_value_bytes = max_value_bytes
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    async def get(self, name: str) -> bytes | None:
+        """
+        Returns:
+        - The cached bytes, or None if the name is missing or Redis unavailable.
+        """
+        return (await self.get_many([name]))[0]
+
+    async def get_many(self, names: list[str]) -> list[bytes | None]:
+        """
+        Gets several cached values in a single round trip.
+
+        Returns:
+        - The cached bytes of each name, in the same order, None for the missing ones.
+        """
+        if not names:
+            return []
+        try:
+            async with Redis(connection_pool=self.redis_pool) as redis:
+                values = await redis.mget([self.get_key(name) for name in names])
+        except RedisError as exc:
+            logger.warning(f"Redis cache unavailable: {exc}")
+            values = [None] * len(names)
+        found = sum(value is not None for value in values)
+        self.hits += found
+        self.misses += len(values) - found
+        return values
+
+    async def set(self, name: str, value: bytes) -> bool:
+        """
+        Caches a value, unless it's over the size limit.
+
+        Returns:
+        - True if the value was cached.
+        """
+        return (await self.set_many({name: value}))[0]
+
+    async def set_many(self, values: dict[str, bytes]) -> list[bool]:
+        """
+        Caches several values in a single round trip.
+
+        Returns:
+        - Whether each value was cached, in the same order.
+        """
+        cached = [len(value) <= self.max_value_bytes for value in values.values()]
+        if not any(cached):
+            return cached
+        try:
+            async with Redis(connection_pool=self.redis_pool) as redis:
+                async with redis.pipeline(transaction=False) as pipe:
+                    for (name, value), cache in zip(values.items(), cached):
+                        if cache:
+                            pipe.set(self.get_key(name), value, ex=self.ttl)
+                    await pipe.execute()
+        except RedisError as exc:
+            logger.warning(f"Redis cache unavailable: {exc}")
+            return [False] * len(cached)
+        return cached
+
+    async def delete(self, name: str) -> None:
+        try:
+            async with Redis(connection_pool=self.redis_pool) as redis:
+                await redis.delete(self.get_key(name))
+        except RedisError as exc:
+            logger.warning(f"Redis cache unavailable: {exc}")
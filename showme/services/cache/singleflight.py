@@ -0,0 +1,43 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls sharing a key into a single execution.
+
+    The first caller starts the call, the ones arriving while it's in flight
+    await the same result instead of repeating the work.
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Runs func unless a call with the same key is already in flight.
+
+        The call runs as its own task, so a cancelled caller doesn't cancel it
+        for the others awaiting it.
+
+        Parameters:
+        - key: Identifies the calls to coalesce.
+        - func: Starts the call.
+
+        Returns:
+        - The call's result, shared by every caller of the key.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = asyncio.ensure_future(func())
+            self._calls[key] = call
+            call.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(call)
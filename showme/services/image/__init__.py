@@ -1,4 +1,6 @@
 """Image service."""
 
 from .base import *  # noqa
+from .engines import *  # noqa
 from .exceptions import *  # noqa
+from .keys import *  # noqa
@@ -1,16 +1,58 @@
+import asyncio
 from abc import ABC
+from contextlib import suppress
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, NamedTuple
 from .exceptions import CountryNotFoundException
 import io
-from shapely.geometry import shape, Polygon, MultiPolygon
-from shapely.ops import unary_union
+from shapely.geometry import shape
+import numpy as np
 import shapely
 import geopandas as gpd
-import matplotlib.pyplot as plt
 import orjson
-from showme.services.blob import ImageStorageService
+from loguru import logger
+from redis.exceptions import RedisError
+from showme.services.blob import BaseImageStorage, UploadQueue
+from showme.services.cache import LRUBytesCache, RedisBytesCache, SingleFlight
+from .engines import MatplotlibRenderEngine, RasterRenderEngine, RenderEngine
+from .exceptions import RenderEngineNotFoundException
+from .figures import FigurePool
+from .keys import (
+    RenderKey,
+    RenderKeyBuilder,
+    get_image_etag,
+    get_md5_etag,
+    normalize_filter_value,
+)
+
+if TYPE_CHECKING:
+    from showme.services.redis import RedisLease
+    from showme.services.render import RenderExecutor, RenderLimiter
+
+# Columns the endpoints filter on, indexed once at load time.
+INDEXED_COLUMNS = ("sovereignt", "economy", "income_grp")
+# Extra columns whose values resolve to the same rows as the indexed column.
+INDEX_ALIASES = {"sovereignt": ("iso_a3", "adm0_a3")}
+# Group columns whose members are dissolved into one geometry at load time.
+DISSOLVED_COLUMNS = ("economy", "income_grp")
+# Placeholder Natural Earth uses for codes that don't exist.
+MISSING_CODE = "-99"
+# Segments used to approximate a quarter circle when buffering.
+DEFAULT_QUAD_SEGS = 16
+# Byte budget of the processed geometries kept in memory, as WKB.
+DEFAULT_GEOMETRY_CACHE_BYTES = 32 * 1024 * 1024
+# Byte budget of the rendered images kept in memory.
+DEFAULT_IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+# Byte budget of the rendered images' entity tags kept in memory.
+DEFAULT_ETAG_CACHE_BYTES = 1024 * 1024
+# Size up to which images streamed from the storage are cached on the way.
+STREAM_CACHE_MAX_BYTES = 1024 * 1024
 
 
 class BaseImageService(ABC):
+    render_engines: dict[str, RenderEngine]
+    default_engine: str
+
     def find_feature_by_country_gdf_as_geojson(
         self,
         filter_name: str,
@@ -43,74 +85,107 @@ class BaseImageService(ABC):
         matching_features_geojson = matching_features.to_json()
         return orjson.loads(matching_features_geojson)
 
-    def clean_canvas(self, ax):
-        """Removes the frame, ticks, and spines from a Matplotlib axis."""
-        ax.set_frame_on(False)
-        ax.spines["top"].set_visible(False)
-        ax.spines["right"].set_visible(False)
-        ax.spines["bottom"].set_visible(False)
-        ax.spines["left"].set_visible(False)
-        ax.get_xaxis().set_ticks([])
-        ax.get_yaxis().set_ticks([])
-
     def plot_geojson_and_save(
         self,
         geojson_data: dict,
         text: str,
         text_position=(0.01, 0.99),
         text_kwargs=None,
+        engine: str | None = None,
     ) -> io.BytesIO:
         """
         Plots GeoJSON data, adds optional text, and saves it to a file.
 
         Parameters:
         - geojson_data: A GeoJSON object representing geographic data.
-        - filename: The name of the file where the plot will be saved. Default is 'geojson_plot.png'.
         - text: Optional text to add to the plot. If None, no text is added.
         - text_position: A tuple (x, y) specifying the position of the text. Coordinates are relative to the plot's axes (from 0 to 1).
         - text_kwargs: A dictionary of keyword arguments to customize the appearance of the text. Check matplotlib's `text` documentation for available options.
         """
-        # Convert the GeoJSON data to a GeoDataFrame
-        gdf = gpd.GeoDataFrame.from_features(geojson_data)
-
-        # Plotting
-        fig, ax = plt.subplots(figsize=(10, 10))  # Adjust the size as needed
-        gdf.plot(ax=ax)
-
-        if text is not None:
-            default_text_kwargs = {
-                "fontsize": 60,
-                "fontweight": "bold",
-                "fontname": "Arial",
-                "color": "black",
-                "ha": "left",
-                "va": "top",
-            }
-            text_kwargs = text_kwargs or {}
-            default_text_kwargs.update(text_kwargs)
-            ax.text(
-                text_position[0],
-                text_position[1],
-                text,
-                transform=ax.transAxes,
-                **default_text_kwargs,
-            )
+        geometries = gpd.GeoSeries(
+            [shape(feature["geometry"]) for feature in geojson_data["features"]],
+        )
+        return self.plot_geometries_and_save(
+            geometries,
+            text,
+            text_position=text_position,
+            text_kwargs=text_kwargs,
+            engine=engine,
+        )
+
+    def plot_geometries_and_save(
+        self,
+        geometries: gpd.GeoSeries,
+        text: str,
+        text_position=(0.01, 0.99),
+        text_kwargs=None,
+        engine: str | None = None,
+    ) -> io.BytesIO:
+        """
+        Plots shapely geometries, adds optional text, and saves it to a file.
 
-        self.clean_canvas(ax)
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png", bbox_inches="tight")
-        plt.close()  # Close the plot to free memory
-        buf.seek(0)
-        return buf
+        Parameters:
+        - geometries: A GeoSeries of the geometries to draw.
+        - text: Optional text to add to the plot. If None, no text is added.
+        - text_position: A tuple (x, y) specifying the position of the text. Coordinates are relative to the plot's axes (from 0 to 1).
+        - text_kwargs: A dictionary of keyword arguments to customize the appearance of the text. Check the render engine's documentation for available options.
+        - engine: Name of the render engine to use, the service's default if None.
+        """
+        render_engine = self.get_render_engine(engine)
+        return render_engine.render(geometries, text, text_position, text_kwargs)
+
+    def get_render_engine(self, engine: str | None = None) -> RenderEngine:
+        """
+        Gets a render engine by name, the default one if no name is given.
+
+        Raises:
+        - RenderEngineNotFoundException: If there's no engine by that name.
+        """
+        engine = engine or self.default_engine
+        if engine not in self.render_engines:
+            raise RenderEngineNotFoundException(f"No render engine named {engine}")
+        return self.render_engines[engine]
 
 
 class ImageService(BaseImageService):
-    def __init__(self, world_file_path: str = "data/world.geojson"):
+    feature_index: dict[str, dict[str, list[int]]]
+    dissolved_geometries: dict[str, dict[str, shapely.Geometry]]
+
+    def __init__(
+        self,
+        world_file_path: str = "data/world.geojson",
+        quad_segs: int = DEFAULT_QUAD_SEGS,
+        grid_size: float | None = None,
+        geometry_cache: LRUBytesCache | None = None,
+        key_builder: RenderKeyBuilder | None = None,
+        figure_pool: FigurePool | None = None,
+        default_engine: str = RasterRenderEngine.name,
+    ):
+        """
+        - world_file_path: The GeoJSON file holding the countries.
+        - quad_segs: Default buffer resolution, in segments per quarter circle.
+        - grid_size: Precision grid the buffered parts are unioned on, None for full precision.
+        - geometry_cache: In-memory cache of the processed geometries, as WKB.
+        - key_builder: Canonicalizes the render parameters into cache and blob keys.
+        - figure_pool: The figures the matplotlib render engine draws on.
+        - default_engine: Name of the render engine used when none is requested.
+        """
+        self.quad_segs = quad_segs
+        self.grid_size = grid_size
+        self.key_builder = key_builder or RenderKeyBuilder()
+        self.render_engines = {
+            RasterRenderEngine.name: RasterRenderEngine(),
+            MatplotlibRenderEngine.name: MatplotlibRenderEngine(figure_pool),
+        }
+        self.default_engine = default_engine
+        if geometry_cache is None:
+            geometry_cache = LRUBytesCache(DEFAULT_GEOMETRY_CACHE_BYTES)
+        self.geometry_cache = geometry_cache
         self.world_geojson = self.load_feature_collection(world_file_path)
 
     def load_feature_collection(self, geojson_path) -> gpd.GeoDataFrame:
         """
-        Loads a feature collection from a GeoJSON file.
+        Loads a feature collection from a GeoJSON file and indexes its filter columns.
 
         Parameters:
         - geojson_path: The file path to the GeoJSON file.
@@ -119,66 +194,671 @@ class ImageService(BaseImageService):
         - A GeoDataFrame containing the features from the GeoJSON file.
         """
         gdf = gpd.read_file(geojson_path)
+        self.feature_index = self.build_feature_index(gdf)
+        self.dissolved_geometries = self.build_dissolved_geometries(gdf)
         return gdf
 
+    def build_feature_index(self, gdf) -> dict[str, dict[str, list[int]]]:
+        """
+        Maps each normalized value of the indexed columns to its row positions.
+
+        Values of the alias columns (ISO codes) are added to the index of the
+        column they alias, so 'tunisia', 'TUN' and 'Tunisia' resolve the same rows.
+
+        Parameters:
+        - gdf: A GeoDataFrame containing the feature collection.
+
+        Returns:
+        - A dict of column name to {normalized value: row positions}.
+        """
+        feature_index = {}
+        for column in INDEXED_COLUMNS:
+            if column not in gdf.columns:
+                continue
+            column_index: dict[str, list[int]] = {}
+            for source in (column, *INDEX_ALIASES.get(column, ())):
+                if source not in gdf.columns:
+                    continue
+                for position, value in enumerate(gdf[source]):
+                    if not isinstance(value, str) or value == MISSING_CODE:
+                        continue
+                    positions = column_index.setdefault(
+                        normalize_filter_value(value),
+                        [],
+                    )
+                    if position not in positions:
+                        positions.append(position)
+            feature_index[column] = column_index
+        return feature_index
+
+    def build_dissolved_geometries(self, gdf) -> dict[str, dict[str, shapely.Geometry]]:
+        """
+        Unions the members of every economy and income group into one valid geometry.
+
+        The groups are few and fixed, so rendering one becomes a single-geometry
+        operation instead of buffering and merging each member country.
+
+        Parameters:
+        - gdf: A GeoDataFrame containing the feature collection.
+
+        Returns:
+        - A dict of column name to {normalized value: dissolved geometry}.
+        """
+        geometries = gdf.geometry.to_numpy()
+        dissolved_geometries = {}
+        for column in DISSOLVED_COLUMNS:
+            dissolved_geometries[column] = {
+                value: shapely.make_valid(shapely.union_all(geometries[positions]))
+                for value, positions in self.feature_index.get(column, {}).items()
+            }
+        return dissolved_geometries
+
+    def find_features(self, filter_name: str, filter_value: str) -> gpd.GeoDataFrame:
+        """
+        Looks up the features matching a filter through the feature index.
+
+        Columns that aren't indexed fall back to a full scan of the GeoDataFrame.
+
+        Raises:
+        - CountryNotFoundException: If no matching feature is found.
+        """
+        column_index = self.feature_index.get(filter_name)
+        if column_index is None:
+            matching_features = self.world_geojson[
+                self.world_geojson[filter_name] == filter_value
+            ]
+        else:
+            positions = column_index.get(normalize_filter_value(filter_value), [])
+            matching_features = self.world_geojson.iloc[positions]
+
+        if matching_features.empty:
+            raise CountryNotFoundException(
+                f"No matching countries under {filter_name} = {filter_value}",
+            )
+        return matching_features
+
+    def resolve_filter_value(self, filter_name: str, filter_value: str) -> str:
+        """
+        Canonical form of a filter value.
+
+        Indexed values, aliases included, resolve to the normalized value of the
+        column itself, so 'TUN', 'tunisia' and 'Tunisia' share one canonical form.
+
+        Raises:
+        - CountryNotFoundException: If the value isn't in the index.
+        """
+        column_index = self.feature_index.get(filter_name)
+        if column_index is None:
+            return filter_value.strip()
+        positions = column_index.get(normalize_filter_value(filter_value))
+        if not positions:
+            raise CountryNotFoundException(
+                f"No matching countries under {filter_name} = {filter_value}",
+            )
+        return normalize_filter_value(
+            self.world_geojson[filter_name].iat[positions[0]],
+        )
+
+    def get_display_value(self, filter_name: str, filter_value: str) -> str:
+        """The filter value as spelled in the dataset, used to label images."""
+        positions = self.feature_index.get(filter_name, {}).get(filter_value)
+        if not positions:
+            return filter_value
+        return self.world_geojson[filter_name].iat[positions[0]]
+
+    def get_render_key(
+        self,
+        filter_name: str,
+        filter_value: str,
+        buffer: float,
+        simplify: float,
+        quad_segs: int | None = None,
+        engine: str | None = None,
+    ) -> RenderKey:
+        """
+        Builds the canonical key of a render request.
+
+        Raises:
+        - CountryNotFoundException: If no matching feature is found.
+        - RenderEngineNotFoundException: If there's no engine by that name.
+        """
+        return self.key_builder.build(
+            filter_name,
+            self.resolve_filter_value(filter_name, filter_value),
+            buffer,
+            simplify,
+            quad_segs or self.quad_segs,
+            self.get_render_engine(engine).name,
+        )
+
+    def get_country_geometries(self, key: RenderKey) -> gpd.GeoSeries:
+        """
+        Buffers and simplifies the geometries matching a render key.
+
+        The geometries stay shapely objects all the way, no GeoJSON is produced.
+        The result is cached apart from any rendering, so every output format
+        and presentation of the same selection reuses it.
+
+        Raises:
+        - CountryNotFoundException: If no matching feature is found.
+        """
+        cached_geometry = self.geometry_cache.get(key.geometry_key)
+        if cached_geometry is not None:
+            merged = shapely.from_wkb(cached_geometry)
+        else:
+            merged = self.process_geometries(
+                self.find_geometries(key.filter_name, key.filter_value),
+                key.buffer,
+                key.simplify,
+                key.quad_segs,
+            )
+            self.geometry_cache.set(key.geometry_key, shapely.to_wkb(merged))
+        return gpd.GeoSeries([merged], crs=self.world_geojson.crs)
+
+    def find_geometries(self, filter_name: str, filter_value: str):
+        """
+        Array of the geometries matching a filter.
+
+        Groups come back as their precomputed dissolved geometry.
+
+        Raises:
+        - CountryNotFoundException: If no matching feature is found.
+        """
+        dissolved = self.dissolved_geometries.get(filter_name, {}).get(
+            normalize_filter_value(filter_value),
+        )
+        if dissolved is not None:
+            return np.array([dissolved])
+        return self.find_features(filter_name, filter_value).geometry.to_numpy()
+
+    def process_geometries(
+        self,
+        geometries,
+        buffer: float,
+        simplify: float,
+        quad_segs: int | None = None,
+    ) -> shapely.Geometry:
+        """
+        Buffers then simplifies every polygon part of a selection and unions them.
+
+        Each step is a single vectorized shapely call over all the parts, so the
+        cost doesn't grow with Python-level loops over countries and islands.
+
+        Parameters:
+        - geometries: An array of (multi)polygons.
+        - buffer: The buffer distance.
+        - simplify: The simplification tolerance.
+        - quad_segs: The buffer resolution, defaults to the service's.
+
+        Returns:
+        - A single geometry covering the whole selection.
+        """
+        parts = shapely.get_parts(geometries)
+        parts = shapely.buffer(
+            parts,
+            buffer,
+            quad_segs=quad_segs or self.quad_segs,
+        )
+        parts = shapely.simplify(parts, simplify)
+        return shapely.union_all(parts, grid_size=self.grid_size)
+
+    def render_image(self, key: RenderKey) -> io.BytesIO:
+        """Renders the image of a render key as a PNG."""
+        geometries = self.get_country_geometries(key)
+        display_value = self.get_display_value(key.filter_name, key.filter_value)
+        return self.plot_geometries_and_save(
+            geometries,
+            text=f"{key.filter_name}: {display_value}",
+            engine=key.engine,
+        )
+
+    def get_image(self, key: RenderKey) -> io.BytesIO:
+        """Gets the PNG image of a render key."""
+        return self.render_image(key)
+
     def get_country_image(
         self,
         filter_name: str,
         filter_value: str,
         buffer: float,
         simplify: float,
+        quad_segs: int | None = None,
+        engine: str | None = None,
     ) -> io.BytesIO:
-        geojson_feature = self.find_feature_by_country_gdf_as_geojson(
+        key = self.get_render_key(
             filter_name,
             filter_value,
-            self.world_geojson,
+            buffer,
+            simplify,
+            quad_segs,
+            engine,
         )
-        for idx, each in enumerate(geojson_feature["features"]):
-            country_geom: Polygon | MultiPolygon = shape(
-                each["geometry"],
-            )
+        return self.get_image(key)
 
-            if isinstance(country_geom, Polygon):
-                country_geom = country_geom.buffer(buffer).simplify(simplify)
-            else:
-                country_geom = unary_union(
-                    [g.buffer(buffer).simplify(simplify) for g in country_geom.geoms],
-                )
 
-            geojson_feature["features"][idx]["geometry"] = orjson.loads(
-                shapely.to_geojson(country_geom),
-            )
-        country_image_buffer = self.plot_geojson_and_save(
-            geojson_feature,
-            text=f"{filter_name}: {filter_value}",
-        )
-        return country_image_buffer
+class ImageStream(NamedTuple):
+    """An image being streamed from the blob storage."""
+
+    size: int
+    chunks: AsyncIterator[bytes]
+    # Entity tag of the image, if the storage keeps its digest.
+    etag: str | None = None
 
 
 class ImageServicePersisted(ImageService):
+    """
+    Asynchronous image service persisting the rendered images.
+
+    Images are looked up in memory, then in the Redis cache shared by the
+    processes, then in the blob storage, and only rendered when found in none. Renders run on the render executor's
+    processes when there is one, in a thread otherwise, so they never
+    block the event loop.
+    """
+
     def __init__(
         self,
-        storage_service: ImageStorageService,
+        storage_service: BaseImageStorage,
         world_file_path: str = "data/world.geojson",
+        quad_segs: int = DEFAULT_QUAD_SEGS,
+        grid_size: float | None = None,
+        geometry_cache: LRUBytesCache | None = None,
+        key_builder: RenderKeyBuilder | None = None,
+        figure_pool: FigurePool | None = None,
+        default_engine: str = RasterRenderEngine.name,
+        image_cache: LRUBytesCache | None = None,
+        render_executor: "RenderExecutor | None" = None,
+        render_limiter: "RenderLimiter | None" = None,
+        render_lease: "RedisLease | None" = None,
+        shared_cache: RedisBytesCache | None = None,
+        etag_cache: LRUBytesCache | None = None,
+        upload_queue: UploadQueue | None = None,
     ):
-        super().__init__(world_file_path)
+        """
+        - storage_service: The blob storage rendered images are persisted to.
+        - image_cache: In-memory cache of rendered images sitting in front of the storage.
+        - render_executor: Process pool the renders run on, None to render in threads.
+        - render_limiter: Bounds the concurrent and waiting renders, None for no bounds.
+        - render_lease: Leases renders across processes, None to only coalesce them in this one.
+        - shared_cache: Redis cache of rendered images between the memory and the storage.
+        - etag_cache: In-memory cache of the rendered images' entity tags.
+        - upload_queue: Persists the rendered images in the background, None to
+            persist them before returning them.
+        """
+        super().__init__(
+            world_file_path,
+            quad_segs,
+            grid_size,
+            geometry_cache,
+            key_builder,
+            figure_pool,
+            default_engine,
+        )
         self.storage_service = storage_service
+        if image_cache is None:
+            image_cache = LRUBytesCache(DEFAULT_IMAGE_CACHE_BYTES)
+        self.image_cache = image_cache
+        self.render_executor = render_executor
+        self.render_limiter = render_limiter
+        self.render_lease = render_lease
+        self.shared_cache = shared_cache
+        if etag_cache is None:
+            etag_cache = LRUBytesCache(DEFAULT_ETAG_CACHE_BYTES)
+        self.etag_cache = etag_cache
+        self.upload_queue = upload_queue
+        self.single_flight = SingleFlight()
 
-    def get_country_image(
+    async def render(self, key: RenderKey) -> bytes:
+        """
+        Renders the PNG image of a render key off the event loop.
+
+        Raises:
+        - RenderQueueFullException: If the render limiter's queue is full.
+        """
+        if self.render_limiter is None:
+            return await self._render(key)
+        async with self.render_limiter.slot():
+            return await self._render(key)
+
+    async def _render(self, key: RenderKey) -> bytes:
+        if self.render_executor is not None:
+            return await self.render_executor.render(key)
+        image = await asyncio.to_thread(self.render_image, key)
+        return image.getvalue()
+
+    async def get_image(self, key: RenderKey) -> io.BytesIO:
+        """
+        Gets the PNG image of a render key from the caches, then from the blob storage.
+
+        Images found in none are rendered and persisted. Concurrent requests
+        for the same image share a single lookup and render.
+        """
+        cached_image = self.image_cache.get(key)
+        if cached_image is None:
+            cached_image = await self.single_flight.do(
+                key,
+                lambda: self._fetch_image(key),
+            )
+        return io.BytesIO(cached_image)
+
+    async def open_image(self, key: RenderKey) -> bytes | Path | ImageStream:
+        """
+        Opens the PNG image of a render key to be sent.
+
+        The image is looked up in memory, then in the shared cache, then
+        in the storage, which may expose the file it's stored in, and is
+        then streamed from it. The stream's first chunk comes with the
+        image's size: images small enough to be cached are read whole and
+        shared by the concurrent requests for them, larger ones are
+        streamed chunk by chunk. Images found in none are rendered and
+        persisted, without being looked up again.
+
+        Raises:
+        - RenderQueueFullException: If the render limiter's queue is full.
+
+        Returns:
+        - The image, the file it's stored in, or its stream.
+        """
+        image = self.image_cache.get(key)
+        if image is not None:
+            return image
+        # Streams aren't shared: the call opening one hands it to its own
+        # caller, and the ones coalesced into it open their own.
+        streams: list[ImageStream] = []
+        opened = await self.single_flight.do(
+            (key, "open"),
+            lambda: self._open_image(key, streams),
+        )
+        if opened is not None:
+            return opened
+        if streams:
+            return streams.pop()
+        stream = await self.stream_image(key)
+        if stream is not None:
+            return stream
+        image_buf = await self.get_image(key)
+        return image_buf.getvalue()
+
+    async def get_image_path(self, key: RenderKey) -> Path | None:
+        """
+        Gets the local file a render key's image is stored in, to be sent as is.
+
+        Returns:
+        - The image's file, None if it isn't stored in a local file.
+        """
+        return await self.storage_service.get_image_path(key.blob_name)
+
+    async def stream_image(
+        self,
+        key: RenderKey,
+    ) -> ImageStream | None:
+        """
+        Streams the PNG image of a render key from the blob storage, chunk by chunk.
+
+        Small images are cached once they're entirely streamed.
+
+        Returns:
+        - The image's stream, None if it isn't in the storage.
+        """
+        stream = await self.storage_service.stream_image(key.blob_name)
+        if stream is None:
+            return None
+        etag = None
+        if stream.content_md5 is not None:
+            etag = get_md5_etag(stream.content_md5)
+            self.etag_cache.set(key, etag.encode())
+        if stream.size > STREAM_CACHE_MAX_BYTES:
+            return ImageStream(stream.size, stream.chunks, etag)
+
+        async def chunks() -> AsyncIterator[bytes]:
+            parts = []
+            async for chunk in stream.chunks:
+                parts.append(chunk)
+                yield chunk
+            image = b"".join(parts)
+            self._remember(key, image)
+            await self._share(key, image)
+
+        return ImageStream(stream.size, chunks(), etag)
+
+    async def iter_images(
+        self,
+        keys: list[RenderKey],
+    ) -> AsyncIterator[tuple[int, io.BytesIO | BaseException]]:
+        """
+        Gets the PNG images of several render keys as they come, looking them
+        all up in the shared cache in a single round trip.
+
+        Yields:
+        - The index of each key along with its image, or the exception that
+          kept it from being fetched or rendered, in the order they're done.
+        """
+        images = [self.image_cache.get(key) for key in keys]
+        missing = [index for index, image in enumerate(images) if image is None]
+        if missing and self.shared_cache is not None:
+            shared_images = await self.shared_cache.get_many(
+                [keys[index].digest for index in missing],
+            )
+            for index, image in zip(missing, shared_images):
+                if image is not None:
+                    images[index] = image
+                    self._remember(keys[index], image)
+            missing = [index for index in missing if images[index] is None]
+        for index, image in enumerate(images):
+            if image is not None:
+                yield index, io.BytesIO(image)
+        # Fetches at most as many images at once as can be rendered,
+        # so large batches wait for their turn instead of being shed.
+        semaphore = asyncio.Semaphore(
+            self.render_limiter.max_concurrency if self.render_limiter else len(keys),
+        )
+
+        async def fetch(index: int) -> tuple[int, bytes | BaseException]:
+            key = keys[index]
+            async with semaphore:
+                try:
+                    image = await self.single_flight.do(
+                        key,
+                        lambda: self._fetch_persisted(key),
+                    )
+                except Exception as exc:
+                    return index, exc
+            self._remember(key, image)
+            return index, image
+
+        tasks = [asyncio.ensure_future(fetch(index)) for index in missing]
+        try:
+            for task in asyncio.as_completed(tasks):
+                index, image = await task
+                if isinstance(image, BaseException):
+                    yield index, image
+                else:
+                    yield index, io.BytesIO(image)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get_image_url(
+        self,
+        key: RenderKey,
+        sas_ttl: int | None = None,
+    ) -> str | None:
+        """
+        Gets the storage URL of a render key's image, if it's already persisted.
+
+        Parameters:
+        - key: The render key.
+        - sas_ttl: Seconds the URL stays valid for, None for its plain URL.
+
+        Returns:
+        - The image's URL, None if it isn't in the storage.
+        """
+        if not await self.storage_service.image_exists(key.blob_name):
+            return None
+        return self.storage_service.get_image_url(key.blob_name, sas_ttl)
+
+    async def get_etag(self, key: RenderKey, stored: bool = False) -> str | None:
+        """
+        Gets the entity tag of a render key's image without fetching the image.
+
+        Parameters:
+        - key: The render key.
+        - stored: Whether to ask the storage for the digest it keeps along with
+          the image, when the caches don't know it. That takes a round trip.
+
+        Returns:
+        - The image's entity tag, None if it isn't known.
+        """
+        etag = self.etag_cache.get(key)
+        if etag is None and self.shared_cache is not None:
+            etag = await self.shared_cache.get(self.get_etag_name(key))
+            if etag is not None:
+                self.etag_cache.set(key, etag)
+        if etag is None and stored:
+            content_md5 = await self.storage_service.get_image_md5(key.blob_name)
+            if content_md5 is not None:
+                etag = get_md5_etag(content_md5).encode()
+                self.etag_cache.set(key, etag)
+        return etag and etag.decode()
+
+    def get_etag_name(self, key: RenderKey) -> str:
+        """Name of an image's entity tag in the shared cache."""
+        return f"{key.digest}:etag"
+
+    def _remember(self, key: RenderKey, image: bytes):
+        self.image_cache.set(key, image)
+        self.etag_cache.set(key, get_image_etag(image).encode())
+
+    async def _fetch_image(self, key: RenderKey) -> bytes:
+        image = None
+        if self.shared_cache is not None:
+            image = await self.shared_cache.get(key.digest)
+        if image is None:
+            image = await self._fetch_persisted(key)
+        self._remember(key, image)
+        return image
+
+    async def _fetch_persisted(self, key: RenderKey) -> bytes:
+        image = await self._download(key)
+        if image is None:
+            return await self._render_leased(key, looked_up=True)
+        await self._share(key, image)
+        return image
+
+    async def _open_image(
+        self,
+        key: RenderKey,
+        streams: list[ImageStream],
+    ) -> bytes | Path | None:
+        image = None
+        if self.shared_cache is not None:
+            image = await self.shared_cache.get(key.digest)
+        if image is None and self.upload_queue is not None:
+            image = self.upload_queue.pending.get(key.blob_name)
+        if image is None:
+            path = await self.get_image_path(key)
+            if path is not None:
+                return path
+            stream = await self.stream_image(key)
+            if stream is None:
+                image = await self._render_leased(key, looked_up=True)
+            elif stream.size > STREAM_CACHE_MAX_BYTES:
+                streams.append(stream)
+                return None
+            else:
+                image = b"".join([chunk async for chunk in stream.chunks])
+        self._remember(key, image)
+        return image
+
+    async def _share(self, key: RenderKey, image: bytes) -> bool:
+        if self.shared_cache is None:
+            return False
+        cached, _ = await self.shared_cache.set_many(
+            {
+                key.digest: image,
+                self.get_etag_name(key): get_image_etag(image).encode(),
+            },
+        )
+        return cached
+
+    async def _render_leased(self, key: RenderKey, looked_up: bool = False) -> bytes:
+        # Only the process holding the render's lease renders it, the others wait
+        # for the lease to be released, then get the image it shared or persisted.
+        # The image is looked up once the lease is held, unless it just was.
+        if self.render_lease is None:
+            return await self._render_and_persist(key)
+        while True:
+            try:
+                lease = await self.render_lease.acquire(key.digest)
+                if lease is None:
+                    await self.render_lease.wait(key.digest)
+            except RedisError as exc:
+                logger.warning(f"Rendering {key} without a lease: {exc}")
+                return await self._render_and_persist(key)
+            if lease is None:
+                image = await self._lookup(key)
+                if image is not None:
+                    return image
+                looked_up = True
+                continue
+            try:
+                image = None if looked_up else await self._lookup(key)
+                if image is None:
+                    image = await self._render_and_persist(key)
+                return image
+            finally:
+                # An unreleased lease only holds the others back until it expires.
+                with suppress(RedisError):
+                    await self.render_lease.release(lease)
+
+    async def _lookup(self, key: RenderKey) -> bytes | None:
+        image = None
+        if self.shared_cache is not None:
+            image = await self.shared_cache.get(key.digest)
+        if image is None:
+            image = await self._download(key)
+        return image
+
+    async def _download(self, key: RenderKey) -> bytes | None:
+        if self.upload_queue is not None:
+            image = self.upload_queue.pending.get(key.blob_name)
+            if image is not None:
+                return image
+        buff = await self.storage_service.download_image(key.blob_name)
+        return buff and buff.getvalue()
+
+    async def _render_and_persist(self, key: RenderKey) -> bytes:
+        # Shared before being persisted, as uploads can be queued. The other
+        # processes waiting for the render's lease can't see queued uploads,
+        # so it's only queued if they get the image from the shared cache.
+        image = await self.render(key)
+        shared = await self._share(key, image)
+        queued = (
+            (shared or self.render_lease is None)
+            and self.upload_queue is not None
+            and self.upload_queue.submit(key.blob_name, image)
+        )
+        if not queued:
+            await self.storage_service.upload_image_if_not_exists(
+                key.blob_name,
+                io.BytesIO(image),
+            )
+        return image
+
+    async def get_country_image(
         self,
         filter_name: str,
         filter_value: str,
         buffer: float,
         simplify: float,
+        quad_segs: int | None = None,
+        engine: str | None = None,
     ) -> io.BytesIO:
-        filename: str = f"{filter_name}_{filter_value}_{buffer}_{simplify}.png"
-        if self.storage_service.image_exists(filename):
-            return self.storage_service.get_image(filename)
-        buff = super().get_country_image(
+        key = self.get_render_key(
             filter_name,
             filter_value,
             buffer,
             simplify,
+            quad_segs,
+            engine,
         )
-        self.storage_service.upload_image_if_not_exists(filename, buff)
-        return buff
+        return await self.get_image(key)
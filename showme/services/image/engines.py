@@ -0,0 +1,224 @@
+import io
+import math
+from abc import ABC, abstractmethod
+
+import numpy as np
+import shapely
+from PIL import Image, ImageDraw, ImageFont
+
+from .figures import FigurePool, plot_polygons
+
+
+class RenderEngine(ABC):
+    """Draws geometries and their label into a PNG image."""
+
+    name: str
+
+    @abstractmethod
+    def render(
+        self,
+        geometries,
+        text: str | None,
+        text_position=(0.01, 0.99),
+        text_kwargs=None,
+    ) -> io.BytesIO:
+        """
+        Renders geometries as a PNG.
+
+        Parameters:
+        - geometries: The (multi)polygons to draw.
+        - text: Optional text to add to the image. If None, no text is added.
+        - text_position: A tuple (x, y) specifying the position of the text, relative to the drawing (from 0 to 1).
+        - text_kwargs: A dictionary of keyword arguments to customize the appearance of the text.
+        """
+
+
+class MatplotlibRenderEngine(RenderEngine):
+    """High-fidelity engine drawing on pooled matplotlib figures."""
+
+    name = "matplotlib"
+
+    def __init__(self, figure_pool: FigurePool | None = None):
+        """- figure_pool: The matplotlib figures renders draw on."""
+        self.figure_pool = figure_pool or FigurePool()
+
+    def render(
+        self,
+        geometries,
+        text: str | None,
+        text_position=(0.01, 0.99),
+        text_kwargs=None,
+    ) -> io.BytesIO:
+        """Check matplotlib's `text` documentation for the available text_kwargs."""
+        with self.figure_pool.figure() as (fig, ax):
+            plot_polygons(ax, geometries)
+            if text is not None:
+                self.add_text(ax, text, text_position, text_kwargs)
+            self.clean_canvas(ax)
+            buf = io.BytesIO()
+            fig.savefig(buf, format="png", bbox_inches="tight")
+        buf.seek(0)
+        return buf
+
+    def clean_canvas(self, ax):
+        """Removes the frame, ticks, labels and spines from a Matplotlib axis."""
+        ax.set_frame_on(False)
+        ax.spines["top"].set_visible(False)
+        ax.spines["right"].set_visible(False)
+        ax.spines["bottom"].set_visible(False)
+        ax.spines["left"].set_visible(False)
+        ax.get_xaxis().set_ticks([])
+        ax.get_yaxis().set_ticks([])
+        ax.set_xlabel("")
+        ax.set_ylabel("")
+
+    def add_text(self, ax, text: str, text_position, text_kwargs=None):
+        """Writes a text at a position relative to the axes (from 0 to 1)."""
+        default_text_kwargs = {
+            "fontsize": 60,
+            "fontweight": "bold",
+            "fontname": "Arial",
+            "color": "black",
+            "ha": "left",
+            "va": "top",
+        }
+        default_text_kwargs.update(text_kwargs or {})
+        ax.text(
+            text_position[0],
+            text_position[1],
+            text,
+            transform=ax.transAxes,
+            **default_text_kwargs,
+        )
+
+
+class RasterRenderEngine(RenderEngine):
+    """
+    Fast engine rasterizing the polygons straight from their coordinate arrays.
+
+    Coordinates are projected to pixels with NumPy and filled with Pillow, which
+    skips matplotlib's layout and draw passes entirely.
+    """
+
+    name = "raster"
+
+    def __init__(
+        self,
+        size: int = 1000,
+        padding: int = 10,
+        color: str = "#1f77b4",
+        background: str = "white",
+        font_size: int = 60,
+        compress_level: int = 3,
+    ):
+        """
+        - size: Size in pixels of the longest side of the drawing.
+        - padding: Margin in pixels around the drawing and the label.
+        - color: Fill and outline color of the polygons.
+        - background: Background color of the image.
+        - font_size: Default size of the label, in pixels.
+        - compress_level: zlib compression level of the PNG, from 0 to 9.
+        """
+        self.size = size
+        self.padding = padding
+        self.color = color
+        self.background = background
+        self.font_size = font_size
+        self.compress_level = compress_level
+        self._fonts: dict[int, ImageFont.FreeTypeFont] = {}
+
+    def render(
+        self,
+        geometries,
+        text: str | None,
+        text_position=(0.01, 0.99),
+        text_kwargs=None,
+    ) -> io.BytesIO:
+        """
+        The label goes in a band above the drawing, the image widening to fit it,
+        so only the horizontal text position applies.
+
+        Supported text_kwargs are 'fontsize' and 'color'.
+        """
+        text_kwargs = text_kwargs or {}
+        polygons = shapely.get_parts(np.asarray(geometries, dtype=object))
+        polygons = polygons[~shapely.is_empty(polygons)]
+        min_x, min_y, max_x, max_y = shapely.total_bounds(polygons)
+        span = max(max_x - min_x, max_y - min_y) or 1.0
+        scale = (self.size - 2 * self.padding) / span
+        drawing_size = (
+            math.ceil((max_x - min_x) * scale) + 2 * self.padding,
+            math.ceil((max_y - min_y) * scale) + 2 * self.padding,
+        )
+
+        font = self.get_font(text_kwargs.get("fontsize", self.font_size))
+        text_box = (0, 0, 0, 0)
+        header = 0
+        if text is not None:
+            text_box = font.getbbox(text)
+            header = text_box[3] - text_box[1] + 2 * self.padding
+        width = max(drawing_size[0], text_box[2] + 2 * self.padding)
+        image = Image.new("RGB", (width, drawing_size[1] + header), self.background)
+        draw = ImageDraw.Draw(image)
+
+        def to_pixels(ring) -> np.ndarray:
+            coords = shapely.get_coordinates(ring)
+            pixels = np.empty_like(coords)
+            pixels[:, 0] = (coords[:, 0] - min_x) * scale + self.padding
+            pixels[:, 1] = (max_y - coords[:, 1]) * scale + self.padding + header
+            return pixels
+
+        for polygon in polygons:
+            exterior = to_pixels(polygon.exterior)
+            interiors = [to_pixels(ring) for ring in polygon.interiors]
+            if not interiors:
+                draw.polygon(exterior.ravel().tolist(), fill=self.color)
+            else:
+                self._fill_with_holes(image, exterior, interiors)
+            for ring in (exterior, *interiors):
+                draw.line(ring.ravel().tolist(), fill=self.color, width=1)
+
+        if text is not None:
+            free_width = width - text_box[2] - 2 * self.padding
+            draw.text(
+                (
+                    self.padding + text_position[0] * free_width,
+                    self.padding - text_box[1],
+                ),
+                text,
+                fill=text_kwargs.get("color", "black"),
+                font=font,
+            )
+
+        buf = io.BytesIO()
+        image.save(buf, format="PNG", compress_level=self.compress_level)
+        buf.seek(0)
+        return buf
+
+    def get_font(self, size: int) -> ImageFont.FreeTypeFont:
+        """Bold font of the given size, falling back to Pillow's bundled font."""
+        if size not in self._fonts:
+            try:
+                font = ImageFont.truetype("DejaVuSans-Bold.ttf", size)
+            except OSError:
+                font = ImageFont.load_default(size=size)
+            self._fonts[size] = font
+        return self._fonts[size]
+
+    def _fill_with_holes(
+        self,
+        image: Image.Image,
+        exterior: np.ndarray,
+        interiors: list[np.ndarray],
+    ):
+        # Holes can hold other parts of the selection, so they're carved out
+        # of a mask limited to this polygon rather than painted over the image.
+        left, top = np.floor(exterior.min(axis=0)).astype(int)
+        right, bottom = np.ceil(exterior.max(axis=0)).astype(int) + 1
+        mask = Image.new("L", (right - left, bottom - top), 0)
+        mask_draw = ImageDraw.Draw(mask)
+        offset = np.array([left, top])
+        mask_draw.polygon((exterior - offset).ravel().tolist(), fill=255)
+        for ring in interiors:
+            mask_draw.polygon((ring - offset).ravel().tolist(), fill=0)
+        image.paste(self.color, (left, top, right, bottom), mask)
@@ -1,2 +1,6 @@
 class CountryNotFoundException(Exception):
     pass
+
+
+class RenderEngineNotFoundException(Exception):
+    pass
@@ -0,0 +1,96 @@
+from redis.asyncio import ConnectionPool
+
+from showme.services.blob import BaseImageStorage
+from showme.services.cache import LRUBytesCache, RedisBytesCache
+from showme.services.redis import RedisLease
+from showme.services.render.limiter import RenderLimiter
+from showme.settings import settings
+
+from .base import ImageService, ImageServicePersisted
+from .figures import FigurePool
+from .keys import RenderKeyBuilder
+
+
+def _image_service_options() -> dict:
+    return {
+        "quad_segs": settings.image_buffer_quad_segs,
+        "grid_size": settings.image_union_grid_size,
+        "geometry_cache": LRUBytesCache(settings.image_geometry_cache_max_bytes),
+        "key_builder": RenderKeyBuilder(
+            buffer_step=settings.image_buffer_step,
+            buffer_range=(settings.image_buffer_min, settings.image_buffer_max),
+            simplify_step=settings.image_simplify_step,
+            simplify_range=(settings.image_simplify_min, settings.image_simplify_max),
+            quad_segs_range=(1, settings.image_quad_segs_max),
+        ),
+        "figure_pool": FigurePool(settings.image_figure_pool_size),
+        "default_engine": settings.image_render_engine.value,
+    }
+
+
+def build_image_service(
+    storage_service: BaseImageStorage,
+    render_limiter: RenderLimiter | None = None,
+) -> ImageServicePersisted:
+    """
+    Creates the image service configured from the settings.
+
+    :param storage_service: the storage rendered images are persisted to.
+    :param render_limiter: bounds of the renders, None for the application's.
+    :return: image service.
+    """
+    return ImageServicePersisted(
+        storage_service=storage_service,
+        image_cache=LRUBytesCache(
+            settings.image_cache_max_bytes,
+            settings.image_cache_ttl,
+        ),
+        render_limiter=render_limiter
+        or RenderLimiter(
+            settings.render_max_concurrency,
+            settings.render_max_queue,
+            settings.render_retry_after,
+        ),
+        **_image_service_options(),
+    )
+
+
+def build_worker_image_service() -> ImageService:
+    """
+    Creates the image service of a render executor's worker.
+
+    :return: image service, without persistence.
+    """
+    return ImageService(**_image_service_options())
+
+
+def build_render_lease(redis_pool: ConnectionPool) -> RedisLease | None:
+    """
+    Creates the render leases shared with the other processes.
+
+    :param redis_pool: redis connection pool.
+    :return: render leases, None when disabled.
+    """
+    if not settings.render_lease_enabled:
+        return None
+    return RedisLease(
+        redis_pool,
+        settings.render_lease_ttl,
+        settings.render_lease_poll_interval,
+    )
+
+
+def build_shared_image_cache(redis_pool: ConnectionPool) -> RedisBytesCache | None:
+    """
+    Creates the rendered images cache shared with the other processes.
+
+    :param redis_pool: redis connection pool.
+    :return: shared cache, None when disabled.
+    """
+    if not settings.image_shared_cache_enabled:
+        return None
+    return RedisBytesCache(
+        redis_pool,
+        settings.image_shared_cache_ttl,
+        settings.image_shared_cache_max_value_bytes,
+    )
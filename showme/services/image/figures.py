@@ -0,0 +1,88 @@
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+import numpy as np
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import PatchCollection
+from matplotlib.figure import Figure
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+from shapely.geometry.polygon import orient
+
+
+class FigurePool:
+    """
+    Pool of reusable Agg figures for rendering outside of pyplot.
+
+    pyplot's global state machine isn't thread-safe, each figure here has its
+    own canvas and is lent to a single thread at a time, then cleared.
+    """
+
+    def __init__(self, size: int = 4, figsize: tuple[float, float] = (10, 10)):
+        """
+        - size: Maximum number of figures, and so of concurrent renders.
+        - figsize: Size of the figures, in inches.
+        """
+        self.size = size
+        self.figsize = figsize
+        self._figures: queue.LifoQueue[tuple[Figure, Axes]] = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def figure(self) -> Iterator[tuple[Figure, Axes]]:
+        """
+        Borrows a cleared figure and its axes, blocking while all of them are in use.
+        """
+        figure, ax = self._acquire()
+        try:
+            yield figure, ax
+        finally:
+            ax.clear()
+            self._figures.put((figure, ax))
+
+    def _acquire(self) -> tuple[Figure, Axes]:
+        try:
+            return self._figures.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    return self._create()
+            return self._figures.get()
+
+    def _create(self) -> tuple[Figure, Axes]:
+        figure = Figure(figsize=self.figsize)
+        FigureCanvasAgg(figure)
+        return figure, figure.add_subplot()
+
+
+def polygon_patch(geometry) -> PathPatch:
+    """
+    Builds a matplotlib patch out of a (multi)polygon.
+
+    Rings are oriented first, as matplotlib tells holes apart by their winding.
+    """
+    paths = []
+    for part in getattr(geometry, "geoms", [geometry]):
+        part = orient(part)
+        paths.append(Path(np.asarray(part.exterior.coords)[:, :2], closed=True))
+        paths.extend(
+            Path(np.asarray(ring.coords)[:, :2], closed=True) for ring in part.interiors
+        )
+    return PathPatch(Path.make_compound_path(*paths))
+
+
+def plot_polygons(ax: Axes, geometries, color: str = "C0") -> PatchCollection:
+    """Draws (multi)polygons on an axes, the way GeoSeries.plot does."""
+    collection = PatchCollection(
+        [polygon_patch(geometry) for geometry in geometries if not geometry.is_empty],
+        facecolor=color,
+    )
+    ax.add_collection(collection, autolim=True)
+    ax.set_aspect("equal")
+    ax.autoscale_view()
+    return collection
@@ -0,0 +1,133 @@
+import hashlib
+from dataclasses import dataclass
+
+
+def normalize_filter_value(value: str) -> str:
+    """Case-folds a filter value and collapses its whitespace."""
+    return " ".join(str(value).split()).casefold()
+
+
+def get_md5_etag(content_md5: bytes) -> str:
+    """Strong HTTP entity tag of an image, out of the MD5 digest of its content."""
+    return f'"{content_md5.hex()}"'
+
+
+def get_image_etag(image: bytes) -> str:
+    """
+    Strong HTTP entity tag of an image, the hash of its content.
+
+    MD5 is the Content-MD5 the blob storage keeps along with each blob,
+    so the tag of a persisted image is known without downloading it.
+    """
+    return get_md5_etag(hashlib.md5(image, usedforsecurity=False).digest())
+
+
+def quantize(value: float, step: float, minimum: float, maximum: float) -> float:
+    """
+    Clamps a float to [minimum, maximum] and snaps it to a grid of the given step.
+
+    The result is rounded to 10 significant digits, so values landing on the
+    same grid point always produce the same float (0.1, 0.10 and 0.1000001).
+    """
+    value = min(max(float(value), minimum), maximum)
+    if step > 0:
+        value = round(value / step) * step
+    return float(f"{min(max(value, minimum), maximum):.10g}")
+
+
+@dataclass(frozen=True)
+class RenderKey:
+    """
+    Canonical identity of a rendered image.
+
+    Two requests producing the same image always get equal keys, and the key's
+    digest names the image in every cache and in the blob storage.
+    """
+
+    filter_name: str
+    filter_value: str
+    buffer: float
+    simplify: float
+    quad_segs: int
+    engine: str
+
+    @property
+    def geometry_key(self) -> tuple:
+        """The part of the key that determines the processed geometry."""
+        return (
+            self.filter_name,
+            self.filter_value,
+            self.buffer,
+            self.simplify,
+            self.quad_segs,
+        )
+
+    @property
+    def digest(self) -> str:
+        """Stable hash of the key."""
+        canonical = "|".join(str(part) for part in (*self.geometry_key, self.engine))
+        return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+    @property
+    def blob_name(self) -> str:
+        """Name of the blob the rendered image is persisted under."""
+        return f"{self.filter_name}_{self.digest}.png"
+
+
+class RenderKeyBuilder:
+    """Builds canonical render keys out of raw request parameters."""
+
+    def __init__(
+        self,
+        buffer_step: float = 0.01,
+        buffer_range: tuple[float, float] = (0.0, 1.0),
+        simplify_step: float = 0.001,
+        simplify_range: tuple[float, float] = (0.0, 1.0),
+        quad_segs_range: tuple[int, int] = (1, 64),
+    ):
+        """
+        - buffer_step: Grid the buffer distance is quantized to.
+        - buffer_range: Allowed (min, max) buffer distance.
+        - simplify_step: Grid the simplification tolerance is quantized to.
+        - simplify_range: Allowed (min, max) simplification tolerance.
+        - quad_segs_range: Allowed (min, max) buffer resolution.
+        """
+        self.buffer_step = buffer_step
+        self.buffer_range = buffer_range
+        self.simplify_step = simplify_step
+        self.simplify_range = simplify_range
+        self.quad_segs_range = quad_segs_range
+
+    def build(
+        self,
+        filter_name: str,
+        filter_value: str,
+        buffer: float,
+        simplify: float,
+        quad_segs: int,
+        engine: str,
+    ) -> RenderKey:
+        """
+        Canonicalizes the parameters of a render request into its key.
+
+        Parameters:
+        - filter_name: The column being filtered on.
+        - filter_value: The filter value, already resolved to its canonical form.
+        - buffer: The raw buffer distance.
+        - simplify: The raw simplification tolerance.
+        - quad_segs: The raw buffer resolution.
+        - engine: Name of the render engine.
+
+        Returns:
+        - The request's RenderKey.
+        """
+        return RenderKey(
+            filter_name=filter_name,
+            filter_value=filter_value,
+            buffer=quantize(buffer, self.buffer_step, *self.buffer_range),
+            simplify=quantize(simplify, self.simplify_step, *self.simplify_range),
+            quad_segs=int(
+                min(max(quad_segs, self.quad_segs_range[0]), self.quad_segs_range[1])
+            ),
+            engine=engine,
+        )
@@ -1 +1,4 @@
 """Redis service."""
+
+from .lease import *  # noqa
+from .progress import *  # noqa
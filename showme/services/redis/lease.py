@@ -0,0 +1,107 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+from redis.asyncio import ConnectionPool, Redis
+from redis.exceptions import WatchError
+
+
+@dataclass(frozen=True)
+class Lease:
+    """A held lease, its token fencing it from the later owners of the same name."""
+
+    name: str
+    token: int
+
+
+class RedisLease:
+    """
+    Leases shared by every process connected to the same Redis.
+
+    A lease expires after its ttl, so a crashed owner never blocks the others
+    for longer than that. Each lease gets a strictly increasing token, and only
+    the owner holding the current token can release it, so an owner whose
+    lease expired can't release the one taken over by another process.
+    """
+
+    def __init__(
+        self,
+        redis_pool: ConnectionPool,
+        ttl: float = 30.0,
+        poll_interval: float = 0.1,
+        prefix: str = "showme:lease:",
+    ):
+        """
+        - redis_pool: The Redis connection pool.
+        - ttl: Seconds after which a lease expires.
+        - poll_interval: Seconds between the checks of a lease held by another process.
+        - prefix: Prefix of the leases' keys.
+        """
+        self.redis_pool = redis_pool
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+
+    def get_key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    async def acquire(self, name: str) -> Lease | None:
+        """
+        Takes the lease of a name.
+
+        Returns:
+        - The lease, None if another process holds it.
+        """
+        key = self.get_key(name)
+        async with Redis(connection_pool=self.redis_pool) as redis:
+            token = await redis.incr(f"{self.prefix}fence")
+            acquired = await redis.set(
+                key,
+                token,
+                nx=True,
+                px=int(self.ttl * 1000),
+            )
+        if not acquired:
+            return None
+        return Lease(name, token)
+
+    async def release(self, lease: Lease) -> bool:
+        """
+        Releases a lease, unless it expired and was taken over since.
+
+        Returns:
+        - True if the lease was still held, and so released.
+        """
+        key = self.get_key(lease.name)
+        async with Redis(connection_pool=self.redis_pool) as redis:
+            async with redis.pipeline() as pipe:
+                try:
+                    await pipe.watch(key)
+                    if await pipe.get(key) != str(lease.token).encode():
+                        return False
+                    pipe.multi()
+                    pipe.delete(key)
+                    await pipe.execute()
+                except WatchError:
+                    return False
+        return True
+
+    async def wait(self, name: str, timeout: float | None = None) -> bool:
+        """
+        Waits for the lease of a name to be released or to expire.
+
+        Parameters:
+        - name: The lease's name.
+        - timeout: Maximum seconds to wait, defaults to the leases' ttl.
+
+        Returns:
+        - True if the lease is free, False if the wait timed out.
+        """
+        deadline = time.monotonic() + (self.ttl if timeout is None else timeout)
+        key = self.get_key(name)
+        async with Redis(connection_pool=self.redis_pool) as redis:
+            while await redis.exists(key):
+                if time.monotonic() >= deadline:
+                    return False
+                await asyncio.sleep(self.poll_interval)
+        return True
@@ -0,0 +1,65 @@
+import orjson
+from redis.asyncio import ConnectionPool, Redis
+
+
+class BatchProgress:
+    """
+    Progress of the batch jobs, shared by the workers running them and the
+    application reporting it.
+
+    A job's size is recorded when it's queued, then its workers append the
+    result of each item as soon as it's done. Both expire after the ttl.
+    """
+
+    def __init__(
+        self,
+        redis_pool: ConnectionPool,
+        ttl: int = 24 * 3600,
+        prefix: str = "showme:batch:",
+    ):
+        """
+        - redis_pool: The Redis connection pool.
+        - ttl: Seconds a job's progress is kept for.
+        - prefix: Prefix of the jobs' keys.
+        """
+        self.redis_pool = redis_pool
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get_key(self, job_id: str, field: str) -> str:
+        return f"{self.prefix}{job_id}:{field}"
+
+    async def start(self, job_id: str, total: int) -> None:
+        """Records a queued job and the number of its items."""
+        async with Redis(connection_pool=self.redis_pool) as redis:
+            await redis.set(self.get_key(job_id, "total"), total, ex=self.ttl)
+
+    async def add(self, job_id: str, item: dict) -> None:
+        """Appends the result of one of a job's items."""
+        key = self.get_key(job_id, "items")
+        async with Redis(connection_pool=self.redis_pool) as redis:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.rpush(key, orjson.dumps(item))
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+
+    async def get(self, job_id: str, start: int = 0) -> tuple[int | None, list[dict]]:
+        """
+        Reads a job's progress in a single round trip.
+
+        Parameters:
+        - job_id: The job.
+        - start: Number of item results already read, which are skipped.
+
+        Returns:
+        - The number of items of the job, None for an unknown job,
+          and the results of its done items, in the order they were done.
+        """
+        async with Redis(connection_pool=self.redis_pool) as redis:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.get(self.get_key(job_id, "total"))
+                pipe.lrange(self.get_key(job_id, "items"), start, -1)
+                total, items = await pipe.execute()
+        if total is None:
+            return None, []
+        return int(total), [orjson.loads(item) for item in items]
@@ -0,0 +1,5 @@
+"""Render service."""
+
+from .base import *  # noqa
+from .exceptions import *  # noqa
+from .limiter import *  # noqa
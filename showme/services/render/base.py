@@ -0,0 +1,99 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from loguru import logger
+
+from showme.services.image import ImageService, RenderKey
+
+# Image service of the current pool worker, loaded once by its initializer.
+_worker_image_service: ImageService | None = None
+
+
+def _init_worker(image_service_factory: Callable[[], ImageService]) -> None:
+    global _worker_image_service  # noqa: WPS420
+    _worker_image_service = image_service_factory()
+
+
+def _warm_up() -> None:
+    """Job returning as soon as the worker running it is initialized."""
+
+
+def _render(key: RenderKey) -> bytes:
+    return _worker_image_service.render_image(key).getvalue()
+
+
+class RenderExecutor:
+    """
+    Pool of processes rendering images out of the event loop's process.
+
+    Workers are spawned, not forked, and started ahead of the first render.
+    Every worker loads the world dataset once, then only receives render keys
+    and sends back PNG bytes, so renders use all the cores instead of being
+    serialized by the GIL of a single worker. A pool broken by a dying worker
+    is replaced by a new one.
+    """
+
+    def __init__(
+        self,
+        image_service_factory: Callable[[], ImageService],
+        workers: int,
+        max_tasks_per_child: int | None = None,
+    ):
+        """
+        - image_service_factory: Builds the image service of each worker, must be picklable.
+        - workers: Number of worker processes.
+        - max_tasks_per_child: Renders after which a worker is replaced, None to keep workers forever.
+        """
+        self.image_service_factory = image_service_factory
+        self.workers = workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self._pool: ProcessPoolExecutor | None = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        """The process pool, created on first use."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.image_service_factory,),
+                max_tasks_per_child=self.max_tasks_per_child,
+            )
+        return self._pool
+
+    async def start(self) -> None:
+        """Spawns all the workers and waits for them to load the dataset."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *[loop.run_in_executor(self.pool, _warm_up) for _ in range(self.workers)],
+        )
+        logger.info(f"Render executor started with {self.workers} workers.")
+
+    async def render(self, key: RenderKey) -> bytes:
+        """
+        Renders the PNG image of a render key on one of the workers.
+
+        Renders failing because a worker died, and broke the pool, are
+        retried once on a new pool.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self.pool
+        try:
+            return await loop.run_in_executor(pool, _render, key)
+        except BrokenProcessPool:
+            logger.warning("A render worker died, restarting the render executor.")
+            # Concurrent renders all see the same broken pool, only one replaces it.
+            if self._pool is pool:
+                self._pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+            return await loop.run_in_executor(self.pool, _render, key)
+
+    async def shutdown(self) -> None:
+        """Stops the workers once they're done with the pending renders."""
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
@@ -0,0 +1,4 @@
+class RenderQueueFullException(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
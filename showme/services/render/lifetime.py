@@ -0,0 +1,67 @@
+from fastapi import FastAPI
+
+from showme.services.image.factory import (
+    build_render_lease,
+    build_worker_image_service,
+)
+from showme.services.render import RenderExecutor
+from showme.settings import settings
+
+
+async def start_render_executor(
+    workers: int,
+    max_tasks_per_child: int | None = None,
+) -> RenderExecutor | None:  # pragma: no cover
+    """
+    Starts a render executor, waiting for its workers to load the dataset.
+
+    :param workers: number of worker processes.
+    :param max_tasks_per_child: renders after which a worker is replaced.
+    :return: the render executor, None without workers.
+    """
+    if workers <= 0:
+        return None
+    render_executor = RenderExecutor(
+        build_worker_image_service,
+        workers,
+        max_tasks_per_child,
+    )
+    await render_executor.start()
+    return render_executor
+
+
+async def init_render_executor(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Starts the render executor and hands it to the image service.
+
+    Without configured workers, images keep being rendered
+    in the application's threadpool.
+
+    :param app: current application.
+    """
+    app.state.render_executor = await start_render_executor(
+        settings.render_workers,
+        settings.render_max_tasks_per_child,
+    )
+    if app.state.render_executor is not None:
+        app.state.image_service.render_executor = app.state.render_executor
+
+
+async def shutdown_render_executor(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Stops the render executor's workers.
+
+    :param app: current application.
+    """
+    if app.state.render_executor is not None:
+        await app.state.render_executor.shutdown()
+
+
+def init_render_lease(app: FastAPI) -> None:  # pragma: no cover
+    """
+    Hands the image service leases shared with the other processes,
+    so they don't render the same images.
+
+    :param app: current application.
+    """
+    app.state.image_service.render_lease = build_render_lease(app.state.redis_pool)
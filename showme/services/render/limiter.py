@@ -0,0 +1,78 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from .exceptions import RenderQueueFullException
+
+RENDER_QUEUE_DEPTH = Gauge(
+    "showme_render_queue_depth",
+    "Renders waiting for a slot.",
+    multiprocess_mode="livesum",
+)
+RENDERS_IN_FLIGHT = Gauge(
+    "showme_renders_in_flight",
+    "Renders currently running.",
+    multiprocess_mode="livesum",
+)
+RENDER_WAIT_SECONDS = Histogram(
+    "showme_render_wait_seconds",
+    "Time renders waited for a slot.",
+)
+RENDERS_REJECTED = Counter(
+    "showme_renders_rejected",
+    "Renders refused because the wait queue was full.",
+)
+
+
+class RenderLimiter:
+    """
+    Bounds the renders running at once, with a bounded queue of waiting ones.
+
+    Once the queue is full new renders are refused right away, shedding load
+    instead of letting every request pile up until it times out.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, retry_after: int = 1):
+        """
+        - max_concurrency: Renders allowed to run at once.
+        - max_queue: Renders allowed to wait for a slot.
+        - retry_after: Seconds refused clients are told to wait before retrying.
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Holds a render slot, waiting for one if they're all taken.
+
+        Raises:
+        - RenderQueueFullException: If the wait queue is full.
+        """
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            RENDERS_REJECTED.inc()
+            raise RenderQueueFullException(
+                "Too many renders in progress, retry later.",
+                self.retry_after,
+            )
+        started_at = time.monotonic()
+        self.waiting += 1
+        RENDER_QUEUE_DEPTH.inc()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            RENDER_QUEUE_DEPTH.dec()
+        RENDER_WAIT_SECONDS.observe(time.monotonic() - started_at)
+        RENDERS_IN_FLIGHT.inc()
+        try:
+            yield
+        finally:
+            RENDERS_IN_FLIGHT.dec()
+            self._semaphore.release()
@@ -21,6 +21,28 @@ class LogLevel(str, enum.Enum):  # noqa: WPS600
     FATAL = "FATAL"
 
 
+class RenderEngineName(str, enum.Enum):  # noqa: WPS600
+    """Available image render engines."""
+
+    RASTER = "raster"
+    MATPLOTLIB = "matplotlib"
+
+
+class ImageResponseMode(str, enum.Enum):  # noqa: WPS600
+    """How the images already in the blob storage are sent."""
+
+    STREAM = "stream"
+    REDIRECT = "redirect"
+    URL = "url"
+
+
+class StorageBackend(str, enum.Enum):  # noqa: WPS600
+    """Where the rendered images are persisted."""
+
+    AZURE = "azure"
+    LOCAL = "local"
+
+
 class Settings(BaseSettings):
     """
     Application settings.
@@ -55,8 +77,93 @@ class Settings(BaseSettings):
     # This variable is used to define
     # multiproc_dir. It's required for [uvi|guni]corn projects.
     prometheus_dir: Path = TEMP_DIR / "prom"
+    # backend the rendered images are persisted to
+    storage_backend: StorageBackend = StorageBackend.AZURE
+    # directory of the local backend, and URL it's served at
+    local_storage_path: Path = TEMP_DIR / "showme" / "images"
+    local_storage_url: str = "/images"
     azure_blob_connection_string: str = os.getenv("AZURE_BLOB_CONNECTION_STRING", "")
     azure_blob_container_name: str = os.getenv("AZURE_BLOB_CONTAINER_NAME", "showme")
+    # connections kept open to the storage account, and requests sent at once
+    azure_blob_max_connections: int = 64
+    azure_blob_max_concurrency: int = 32
+    # bytes downloaded per request, and so per chunk of the streamed images
+    azure_blob_chunk_size: int = 256 * 1024
+    # seconds the URLs of the blobs sent to clients stay valid for,
+    # signed with SAS tokens, None sends their plain URL
+    azure_blob_sas_ttl: Optional[int] = None
+    # names of the container's blobs kept in memory to check them without requests,
+    # and seconds between two listings of the container refreshing them
+    azure_blob_manifest_enabled: bool = True
+    azure_blob_manifest_refresh_interval: float = 300.0
+
+    # Variables for the image rendering
+    # segments per quarter circle used when buffering countries
+    image_buffer_quad_segs: int = 16
+    # grid and allowed range render parameters are canonicalized to
+    image_buffer_step: float = 0.01
+    image_buffer_min: float = 0.0
+    image_buffer_max: float = 1.0
+    image_simplify_step: float = 0.001
+    image_simplify_min: float = 0.0
+    image_simplify_max: float = 1.0
+    image_quad_segs_max: int = 64
+    # precision grid buffered parts are unioned on, None keeps full precision
+    image_union_grid_size: Optional[float] = None
+    # engine rendering the images when the request doesn't pick one
+    image_render_engine: RenderEngineName = RenderEngineName.RASTER
+    # matplotlib figures kept for reuse, bounds the concurrent renders
+    image_figure_pool_size: int = 4
+    # processes rendering the images, 0 renders in the application's threadpool
+    render_workers: int = 0
+    # renders after which a render process is replaced, None keeps them forever
+    render_max_tasks_per_child: Optional[int] = None
+    # renders running at once and waiting for a slot, in each process,
+    # and seconds clients are told to wait when the queue is full
+    render_max_concurrency: int = 4
+    render_max_queue: int = 32
+    render_retry_after: int = 1
+    # the same for the renders of the taskiq workers, whose batches
+    # wait for a slot rather than being refused
+    worker_render_workers: int = 0
+    worker_render_max_tasks_per_child: Optional[int] = None
+    worker_render_max_concurrency: int = 4
+    worker_render_max_queue: int = 1024
+    # renders are leased in Redis so processes don't render the same image twice,
+    # leases expire after the ttl and waiting processes check them every interval
+    render_lease_enabled: bool = True
+    render_lease_ttl: float = 30.0
+    render_lease_poll_interval: float = 0.1
+    # byte budget of the in-memory processed geometries cache
+    image_geometry_cache_max_bytes: int = 32 * 1024 * 1024
+    # byte budget and lifetime (in seconds) of the in-memory rendered images cache
+    image_cache_max_bytes: int = 64 * 1024 * 1024
+    image_cache_ttl: Optional[float] = None
+    # rendered images cache shared by the processes in Redis, its entries'
+    # lifetime (in seconds) and the size above which images aren't cached there
+    image_shared_cache_enabled: bool = True
+    image_shared_cache_ttl: Optional[int] = 24 * 60 * 60
+    image_shared_cache_max_value_bytes: int = 1024 * 1024
+    # rendered images waiting to be persisted in the background (0 persists them
+    # before responding), uploads running at once, retries of failed uploads,
+    # seconds before the first retry and seconds given to the queue on shutdown
+    image_upload_queue_size: int = 256
+    image_upload_workers: int = 4
+    image_upload_max_retries: int = 3
+    image_upload_retry_backoff: float = 0.5
+    image_upload_drain_timeout: float = 30.0
+    # Cache-Control header of the image responses
+    image_cache_control: str = "public, max-age=86400"
+    # how images already in the blob storage are sent when the request doesn't say,
+    # streamed through the application, or redirected to or linked from the storage
+    image_response_mode: ImageResponseMode = ImageResponseMode.STREAM
+    # seconds the progress and results of batch jobs are kept for,
+    # between the checks of a job whose events are streamed,
+    # and without any item done after which its stream is closed
+    batch_progress_ttl: int = 24 * 3600
+    batch_events_poll_interval: float = 0.5
+    batch_events_idle_timeout: float = 300.0
+
     # Grpc endpoint for opentelemetry.
     # E.G. http://localhost:4317
     opentelemetry_endpoint: Optional[str] = None
@@ -0,0 +1,147 @@
+import asyncio
+import hashlib
+from io import BytesIO
+
+import pytest
+from azure.core.exceptions import ServiceRequestError
+
+from showme.services.blob import BlobManifest, LocalImageStorage, UploadQueue
+
+
+@pytest.mark.anyio
+async def test_blob_manifest_answers_once_loaded():
+    manifest = BlobManifest()
+    assert manifest.get("a.png") is None
+
+    async def list_names():
+        return ["a.png"]
+
+    await manifest.refresh(list_names)
+
+    assert manifest.get("a.png")
+    assert manifest.get("b.png") is False
+
+
+@pytest.mark.anyio
+async def test_blob_manifest_keeps_changes_made_during_refresh():
+    manifest = BlobManifest()
+
+    async def list_names():
+        manifest.add("b.png")
+        manifest.discard("a.png")
+        return ["a.png"]
+
+    await manifest.refresh(list_names)
+
+    assert manifest.get("a.png") is False
+    assert manifest.get("b.png")
+
+
+class ListingFailingStorage(LocalImageStorage):
+    def __init__(self, path):
+        super().__init__(path)
+        self.refreshes = 0
+
+    async def refresh_manifest(self):
+        self.refreshes += 1
+        if self.refreshes == 1:
+            raise OSError("Listing failed")
+
+
+@pytest.mark.anyio
+async def test_manifest_refresh_survives_unexpected_errors(tmp_path):
+    storage = ListingFailingStorage(tmp_path)
+    refreshing = asyncio.create_task(storage.run_manifest_refresh(0.001))
+
+    async def refreshed_again():
+        while storage.refreshes < 2:
+            await asyncio.sleep(0.001)
+
+    try:
+        await asyncio.wait_for(refreshed_again(), timeout=1)
+        assert not refreshing.done()
+    finally:
+        refreshing.cancel()
+
+
+class FlakyStorage:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.blobs: dict[str, bytes] = {}
+
+    async def upload_image_if_not_exists(self, blob_name: str, bytes_io: BytesIO):
+        if self.failures:
+            self.failures -= 1
+            raise ServiceRequestError("Connection reset.")
+        self.blobs[blob_name] = bytes_io.getvalue()
+        return True
+
+
+@pytest.mark.anyio
+async def test_upload_queue_retries_and_drains():
+    storage = FlakyStorage(failures=2)
+    upload_queue = UploadQueue(storage, max_size=1, workers=1, retry_backoff=0.001)
+    upload_queue.start()
+
+    assert upload_queue.submit("a.png", b"aaaa")
+    assert upload_queue.pending == {"a.png": b"aaaa"}
+    assert not upload_queue.submit("b.png", b"bbbb")
+
+    await upload_queue.drain(timeout=1)
+
+    assert storage.blobs == {"a.png": b"aaaa"}
+    assert not upload_queue.pending
+
+
+class FullDiskStorage(FlakyStorage):
+    def __init__(self):
+        super().__init__(failures=0)
+        self.attempts: list[str] = []
+
+    async def upload_image_if_not_exists(self, blob_name: str, bytes_io: BytesIO):
+        self.attempts.append(blob_name)
+        if blob_name == "a.png":
+            raise OSError(28, "No space left on device")
+        return await super().upload_image_if_not_exists(blob_name, bytes_io)
+
+
+@pytest.mark.anyio
+async def test_upload_queue_survives_unexpected_errors():
+    storage = FullDiskStorage()
+    upload_queue = UploadQueue(storage, workers=1, retry_backoff=0.001)
+    upload_queue.start()
+
+    assert upload_queue.submit("a.png", b"aaaa")
+    assert upload_queue.submit("b.png", b"bbbb")
+
+    await upload_queue.drain(timeout=1)
+
+    assert storage.attempts == ["a.png", "b.png"]
+    assert storage.blobs == {"b.png": b"bbbb"}
+    assert not upload_queue.pending
+
+
+@pytest.mark.anyio
+async def test_local_storage_never_overwrites(tmp_path):
+    storage = LocalImageStorage(tmp_path, base_url="/images/")
+
+    assert await storage.upload_image_if_not_exists("a.png", BytesIO(b"first"))
+    assert not await storage.upload_image_if_not_exists("a.png", BytesIO(b"second"))
+
+    assert (await storage.download_image("a.png")).getvalue() == b"first"
+    stream = await storage.stream_image("a.png")
+    assert stream.size == 5
+    assert b"".join([chunk async for chunk in stream.chunks]) == b"first"
+    assert await storage.get_image_md5("a.png") == hashlib.md5(b"first").digest()
+    path = await storage.get_image_path("a.png")
+    assert path.read_bytes() == b"first"
+    assert storage.get_image_url("a.png") == (
+        f"/images/{path.relative_to(tmp_path).as_posix()}"
+    )
+    assert list(path.parent.iterdir()) == [path]
+
+    assert await storage.delete_image("a.png")
+    assert not await storage.image_exists("a.png")
+    assert await storage.get_image_path("a.png") is None
+    assert await storage.stream_image("a.png") is None
+    assert await storage.get_image_md5("a.png") is None
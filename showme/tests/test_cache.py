@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+from redis.asyncio import ConnectionPool
+
+from showme.services.cache import LRUBytesCache, RedisBytesCache, SingleFlight
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUBytesCache(max_bytes=10)
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("a") == b"aaaa"
+
+    cache.set("c", b"cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+    assert cache.size == 8
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_lru_cache_skips_values_over_budget():
+    cache = LRUBytesCache(max_bytes=4)
+
+    assert not cache.set("a", b"aaaaa")
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUBytesCache(max_bytes=10, ttl=0.01)
+    cache.set("a", b"aaaa")
+    time.sleep(0.02)
+
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+@pytest.mark.anyio
+async def test_single_flight_coalesces_concurrent_calls():
+    single_flight = SingleFlight()
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return b"image"
+
+    results = await asyncio.gather(
+        *[single_flight.do("key", fetch) for _ in range(5)],
+    )
+
+    assert results == [b"image"] * 5
+    assert calls == 1
+    assert single_flight.coalesced == 4
+    assert len(single_flight) == 0
+
+
+@pytest.mark.anyio
+async def test_redis_cache_gets_many_values_at_once(fake_redis_pool: ConnectionPool):
+    cache = RedisBytesCache(fake_redis_pool, ttl=60, max_value_bytes=4)
+
+    assert await cache.set_many({"a": b"aaaa", "b": b"bbbbb"}) == [True, False]
+    assert await cache.get_many(["a", "b", "c"]) == [b"aaaa", None, None]
+    assert cache.hits == 1
+    assert cache.misses == 2
@@ -1,8 +1,12 @@
 import pytest
 from fastapi import FastAPI
 from httpx import AsyncClient
+from redis.asyncio import ConnectionPool
 from starlette import status
 
+from showme.services.redis import BatchProgress
+from showme.settings import settings
+
 
 @pytest.mark.anyio
 async def test_getting_country_image(
@@ -19,6 +23,67 @@ async def test_getting_country_image(
     assert response.headers["content-disposition"] == "attachment; filename=country.png"
 
 
+@pytest.mark.anyio
+async def test_getting_country_image_by_iso_code(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+) -> None:
+    url = "api/country_name/TUN"
+    response = await client.get(
+        url,
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"] == "image/png"
+
+
+@pytest.mark.anyio
+async def test_getting_country_image_not_modified(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+) -> None:
+    url = "api/country_name/tunisia"
+    response = await client.get(url)
+    etag = response.headers["etag"]
+
+    response = await client.get(url, headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers["etag"] == etag
+    assert not response.content
+
+
+@pytest.mark.anyio
+async def test_getting_country_image_not_modified_once_forgotten(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+) -> None:
+    url = "api/country_name/tunisia"
+    response = await client.get(url)
+    etag = response.headers["etag"]
+    fastapi_app.state.image_service.image_cache.clear()
+    fastapi_app.state.image_service.etag_cache.clear()
+
+    response = await client.get(url, headers={"If-None-Match": etag})
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers["etag"] == etag
+
+
+@pytest.mark.anyio
+async def test_getting_country_image_url(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+) -> None:
+    url = "api/country_name/tunisia"
+    await client.get(url)
+
+    response = await client.get(url, params={"response_mode": "url"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["url"].endswith(".png")
+
+
 @pytest.mark.anyio
 async def test_getting_country_image_exc_not_found(
     fastapi_app: FastAPI,
@@ -98,3 +163,36 @@ async def test_batch(
     response = await client.post(url, json={"filter_values": countries})
 
     assert response.status_code == status.HTTP_201_CREATED
+    job_id = response.json()["job_id"]
+    response = await client.get(f"api/batch/{job_id}")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["total"] == 2
+
+
+@pytest.mark.anyio
+async def test_unknown_batch(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+) -> None:
+    response = await client.get("api/batch/unknown")
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.anyio
+async def test_batch_events_end_without_progress(
+    fastapi_app: FastAPI,
+    client: AsyncClient,
+    fake_redis_pool: ConnectionPool,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(settings, "batch_events_poll_interval", 0.01)
+    monkeypatch.setattr(settings, "batch_events_idle_timeout", 0.05)
+    # A job whose message never reaches a worker.
+    await BatchProgress(fake_redis_pool).start("lost", 1)
+
+    response = await client.get("api/batch/lost/events")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.text.startswith("event: error\n")
@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from showme.services.image import (
+    ImageService,
+    MatplotlibRenderEngine,
+    RasterRenderEngine,
+)
+
+countries = ["France", "Tunisia", "Italy", "Kenya"]
+
+
+@pytest.mark.parametrize(
+    "engine",
+    [MatplotlibRenderEngine.name, RasterRenderEngine.name],
+)
+def test_concurrent_renders_match_serial_renders(engine: str):
+    image_service = ImageService()
+    keys = [
+        image_service.get_render_key(
+            "sovereignt",
+            country,
+            0.1,
+            0.01,
+            engine=engine,
+        )
+        for country in countries
+    ]
+    serial = [image_service.render_image(key).getvalue() for key in keys]
+
+    with ThreadPoolExecutor(len(keys)) as executor:
+        concurrent = list(
+            executor.map(lambda key: image_service.render_image(key).getvalue(), keys),
+        )
+
+    assert concurrent == serial
+
+
+def test_render_engines_produce_png():
+    image_service = ImageService()
+    for engine in image_service.render_engines:
+        key = image_service.get_render_key(
+            "sovereignt",
+            "Tunisia",
+            0.1,
+            0.01,
+            engine=engine,
+        )
+        assert image_service.render_image(key).getvalue().startswith(b"\x89PNG")
@@ -0,0 +1,26 @@
+from showme.services.image import RenderKeyBuilder, quantize
+
+
+def test_quantize_snaps_to_grid():
+    assert quantize(0.1, 0.01, 0.0, 1.0) == 0.1
+    assert quantize(0.10, 0.01, 0.0, 1.0) == 0.1
+    assert quantize(0.1000001, 0.01, 0.0, 1.0) == 0.1
+    assert quantize(0.3, 0.1, 0.0, 1.0) == 0.3
+
+
+def test_quantize_clamps_to_range():
+    assert quantize(5, 0.01, 0.0, 1.0) == 1.0
+    assert quantize(-1, 0.01, 0.0, 1.0) == 0.0
+
+
+def test_render_key_is_canonical():
+    builder = RenderKeyBuilder()
+    key = builder.build("sovereignt", "tunisia", 0.1, 0.01, 16, "raster")
+    same_key = builder.build(
+        "sovereignt", "tunisia", 0.1000001, 0.0100004, 16, "raster"
+    )
+    other_key = builder.build("sovereignt", "tunisia", 0.2, 0.01, 16, "raster")
+
+    assert key == same_key
+    assert key.blob_name == same_key.blob_name
+    assert key.blob_name != other_key.blob_name
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+from redis.asyncio import ConnectionPool
+
+from showme.services.blob import LocalImageStorage, UploadQueue
+from showme.services.image import ImageServicePersisted
+from showme.services.image.factory import build_worker_image_service
+from showme.services.redis import RedisLease
+from showme.services.render import (
+    RenderExecutor,
+    RenderLimiter,
+    RenderQueueFullException,
+)
+
+
+@pytest.mark.anyio
+async def test_render_limiter_sheds_load_when_queue_is_full():
+    limiter = RenderLimiter(max_concurrency=1, max_queue=1, retry_after=3)
+    release = asyncio.Event()
+
+    async def render():
+        async with limiter.slot():
+            await release.wait()
+
+    running = asyncio.create_task(render())
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(render())
+    await asyncio.sleep(0)
+    assert limiter.waiting == 1
+
+    with pytest.raises(RenderQueueFullException) as exc_info:
+        async with limiter.slot():
+            pass  # pragma: no cover
+    assert exc_info.value.retry_after == 3
+
+    release.set()
+    await asyncio.gather(running, waiting)
+    assert limiter.waiting == 0
+
+
+@pytest.mark.anyio
+async def test_render_lease_is_exclusive_and_fenced(fake_redis_pool: ConnectionPool):
+    lease = RedisLease(fake_redis_pool, ttl=5, poll_interval=0.01)
+
+    owner = await lease.acquire("key")
+    assert owner is not None
+    assert await lease.acquire("key") is None
+    assert not await lease.wait("key", timeout=0.05)
+
+    assert await lease.release(owner)
+    assert await lease.wait("key")
+    next_owner = await lease.acquire("key")
+    assert next_owner.token > owner.token
+    assert not await lease.release(owner)
+    assert await lease.release(next_owner)
+
+
+@pytest.mark.anyio
+async def test_render_executor_replaces_a_broken_pool():
+    key = build_worker_image_service().get_render_key(
+        "sovereignt", "Tunisia", 0.1, 0.01
+    )
+    render_executor = RenderExecutor(build_worker_image_service, workers=1)
+    await render_executor.start()
+    try:
+        image = await render_executor.render(key)
+        assert image.startswith(b"\x89PNG")
+
+        for process in list(render_executor.pool._processes.values()):
+            process.kill()
+            process.join()
+
+        assert await render_executor.render(key) == image
+    finally:
+        await render_executor.shutdown()
+    assert render_executor._pool is None
+
+
+@pytest.mark.anyio
+async def test_leased_render_is_stored_before_its_lease_is_released(
+    fake_redis_pool: ConnectionPool,
+    tmp_path,
+):
+    storage = LocalImageStorage(tmp_path, base_url="/images/")
+    upload_queue = UploadQueue(storage)
+    image_service = ImageServicePersisted(
+        storage,
+        render_lease=RedisLease(fake_redis_pool),
+        upload_queue=upload_queue,
+    )
+    key = image_service.get_render_key("sovereignt", "Tunisia", 0.1, 0.01)
+    upload_queue.start()
+    try:
+        image = await image_service.get_image(key)
+
+        # Without the shared cache, the processes waiting for the lease
+        # can only find the image in the storage.
+        assert not upload_queue.pending
+        stored = await storage.download_image(key.blob_name)
+        assert stored.getvalue() == image.getvalue()
+    finally:
+        await upload_queue.drain(timeout=1)
@@ -1,9 +1,17 @@
 import pytest
-from showme.tkq import run_coutries_by_name, run_coutries_by_eco, run_coutries_by_income
+from redis.asyncio import ConnectionPool
+
+from showme.services.redis import BatchProgress
+from showme.tkq import (
+    run_batch,
+    run_coutries_by_name,
+    run_coutries_by_eco,
+    run_coutries_by_income,
+)
 
 countries = ["France", "Tunisia"]
 economies = ["7. Least developed region", "6. Developing region"]
-incomes = ["7. Least developed region", "6. Developing region"]
+incomes = ["5. Low income", "4. Lower middle income"]
 
 
 @pytest.mark.anyio
@@ -31,3 +39,35 @@ async def test_run_coutries_by_income():
     assert len(result) == 2
     for url in result:
         assert "https://showmedemo.blob.core.windows.net/showme/" in url
+
+
+@pytest.mark.anyio
+async def test_run_batch_reports_each_value():
+    task = await run_batch.kiq("sovereignt", ["France", "Atlantis", "Tunisia"])
+    result = (await task.wait_result()).return_value
+    assert [item["filter_value"] for item in result] == [
+        "France",
+        "Atlantis",
+        "Tunisia",
+    ]
+    assert result[1]["url"] is None
+    assert "Atlantis" in result[1]["error"]
+    for item in (result[0], result[2]):
+        assert item["error"] is None
+        assert "https://showmedemo.blob.core.windows.net/showme/" in item["url"]
+
+
+@pytest.mark.anyio
+async def test_batch_progress(fake_redis_pool: ConnectionPool):
+    progress = BatchProgress(fake_redis_pool)
+    assert await progress.get("job") == (None, [])
+
+    await progress.start("job", 2)
+    await progress.add("job", {"filter_value": "France"})
+    await progress.add("job", {"filter_value": "Tunisia"})
+
+    assert await progress.get("job") == (
+        2,
+        [{"filter_value": "France"}, {"filter_value": "Tunisia"}],
+    )
+    assert await progress.get("job", 1) == (2, [{"filter_value": "Tunisia"}])
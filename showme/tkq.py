@@ -1,14 +1,33 @@
+from contextlib import aclosing
+from typing import Awaitable, Callable
+
 import taskiq_fastapi
-from taskiq import InMemoryBroker
+from redis.asyncio import ConnectionPool
+from redis.exceptions import RedisError
+from taskiq import Context, InMemoryBroker, TaskiqDepends, TaskiqEvents, TaskiqState
 from taskiq_redis import ListQueueBroker, RedisAsyncResultBackend
-from showme.services.image import ImageServicePersisted, CountryNotFoundException
-from showme.services.blob import ImageStorageService
+from typing_extensions import TypedDict
+from showme.services.image import (
+    CountryNotFoundException,
+    RenderEngineNotFoundException,
+)
+from showme.services.image.factory import (
+    build_image_service,
+    build_render_lease,
+    build_shared_image_cache,
+)
+from showme.services.blob.factory import build_storage_service
+from showme.services.blob.lifetime import start_blob_manifest
+from showme.services.redis import BatchProgress
+from showme.services.render import RenderLimiter
+from showme.services.render.lifetime import start_render_executor
 from loguru import logger
 
 from showme.settings import settings
 
 result_backend = RedisAsyncResultBackend(
     redis_url=str(settings.redis_url.with_path("/1")),
+    result_ex_time=settings.batch_progress_ttl,
 )
 broker = ListQueueBroker(
     str(settings.redis_url.with_path("/1")),
@@ -23,16 +42,181 @@ taskiq_fastapi.init(
 )
 
 # Singletons
-storage_service = ImageStorageService(
-    settings.azure_blob_connection_string,
-    settings.azure_blob_container_name,
+storage_service = build_storage_service()
+image_service = build_image_service(
+    storage_service,
+    RenderLimiter(
+        settings.worker_render_max_concurrency,
+        settings.worker_render_max_queue,
+        settings.render_retry_after,
+    ),
 )
-image_service = ImageServicePersisted(storage_service=storage_service)
+
+
+@broker.on_event(TaskiqEvents.WORKER_STARTUP)
+async def startup(state: TaskiqState) -> None:  # pragma: no cover
+    """
+    Shares the renders' leases and cache and the batches' progress with the
+    application through Redis, loads the blob manifest and starts the render executor.
+
+    Renders never run on the event loop: they go to the executor's processes,
+    or to its threadpool without any, so the loop stays free for the broker
+    and the blob storage.
+    """
+    state.redis_pool = ConnectionPool.from_url(str(settings.redis_url))
+    state.batch_progress = BatchProgress(state.redis_pool, settings.batch_progress_ttl)
+    image_service.render_lease = build_render_lease(state.redis_pool)
+    image_service.shared_cache = build_shared_image_cache(state.redis_pool)
+    state.blob_manifest_task = await start_blob_manifest(storage_service)
+    state.render_executor = await start_render_executor(
+        settings.worker_render_workers,
+        settings.worker_render_max_tasks_per_child,
+    )
+    image_service.render_executor = state.render_executor
+
+
+@broker.on_event(TaskiqEvents.WORKER_SHUTDOWN)
+async def shutdown(state: TaskiqState) -> None:  # pragma: no cover
+    if state.render_executor is not None:
+        await state.render_executor.shutdown()
+    if state.blob_manifest_task is not None:
+        state.blob_manifest_task.cancel()
+    await storage_service.close()
+    await state.redis_pool.disconnect()
+
+
+class BatchItemResult(TypedDict):
+    """Outcome of a single filter value of a batch."""
+
+    filter_value: str
+    url: str | None
+    error: str | None
+
+
+async def process_batch(
+    filter_name: str,
+    filter_values: list[str],
+    buffer: float = 0.1,
+    simplify: float = 0.01,
+    quad_segs: int | None = None,
+    engine: str | None = None,
+    on_result: Callable[[BatchItemResult], Awaitable[None]] | None = None,
+) -> list[BatchItemResult]:
+    """
+    Persists the images of a batch of filter values.
+
+    The images are fetched together, so the cached ones are looked up in a
+    single round trip and the others are rendered concurrently, bounded by
+    the render limiter, on the render executor's threads or processes.
+    A failing value doesn't fail the others, its error is in its result.
+
+    Parameters:
+    - filter_name: The column being filtered on.
+    - filter_values: The values to render, in the order of the results.
+    - buffer: The buffer distance.
+    - simplify: The simplification tolerance.
+    - quad_segs: The buffer resolution, None for the service's default.
+    - engine: Name of the render engine, None for the default one.
+    - on_result: Called with the result of each value as soon as it's done.
+
+    Returns:
+    - The result of each value, holding its image's URL or its error.
+    """
+    results: list[BatchItemResult] = [
+        {"filter_value": filter_value, "url": None, "error": None}
+        for filter_value in filter_values
+    ]
+    indexes = []
+    keys = []
+    for index, filter_value in enumerate(filter_values):
+        try:
+            keys.append(
+                image_service.get_render_key(
+                    filter_name,
+                    filter_value,
+                    buffer,
+                    simplify,
+                    quad_segs,
+                    engine,
+                ),
+            )
+        except (CountryNotFoundException, RenderEngineNotFoundException) as exc:
+            logger.error(f"Error processing {filter_name} {filter_value}: {exc}")
+            results[index]["error"] = str(exc)
+            if on_result is not None:
+                await on_result(results[index])
+        else:
+            indexes.append(index)
+    async with aclosing(image_service.iter_images(keys)) as images:
+        async for position, image in images:
+            key = keys[position]
+            result = results[indexes[position]]
+            if isinstance(image, Exception):
+                logger.error(f"Error rendering {key.blob_name}: {image!r}")
+                result["error"] = str(image) or type(image).__name__
+            else:
+                result["url"] = storage_service.get_image_url(key.blob_name)
+            if on_result is not None:
+                await on_result(result)
+    return results
+
+
+@broker.task
+async def run_batch(
+    filter_name: str,
+    filter_values: list[str],
+    buffer: float = 0.1,
+    simplify: float = 0.01,
+    quad_segs: int | None = None,
+    engine: str | None = None,
+    context: Context = TaskiqDepends(),
+) -> list[BatchItemResult]:
+    """
+    Task to persist the images of a batch of filter values.
+    Returns the result of each value, holding its image's URL or its error.
+
+    The result of each value is also added to the job's progress as soon
+    as it's done, when the worker has one.
+    """
+    batch_progress: BatchProgress | None = getattr(
+        context.state,
+        "batch_progress",
+        None,
+    )
+
+    async def on_result(result: BatchItemResult) -> None:
+        try:
+            await batch_progress.add(context.message.task_id, result)
+        except RedisError as exc:
+            logger.warning(f"Couldn't report the progress of a batch: {exc}")
+
+    results = await process_batch(
+        filter_name,
+        filter_values,
+        buffer,
+        simplify,
+        quad_segs,
+        engine,
+        on_result if batch_progress is not None else None,
+    )
+    failed = sum(result["error"] is not None for result in results)
+    logger.info(f"Processed {len(results)} {filter_name} values, {failed} failed")
+    return results
+
+
+async def get_batch_urls(
+    filter_name: str,
+    filter_values: list[str],
+    buffer: float,
+    simplify: float,
+) -> list[str]:
+    results = await process_batch(filter_name, filter_values, buffer, simplify)
+    return [result["url"] for result in results if result["url"] is not None]
 
 
 @broker.task
 async def run_coutries_by_name(
-    countries_names: str,
+    countries_names: list[str],
     buffer: float = 0.1,
     simplify: float = 0.01,
 ) -> list[str]:
@@ -40,30 +224,12 @@ async def run_coutries_by_name(
     Task to get countries by name.
     Returns the links of images created.
     """
-    image_urls = []
-    for i, country_name in enumerate(countries_names):
-        formatted_country_name = country_name.lower().capitalize()
-        filter_name = "sovereignt"
-        blob_name = f"{filter_name}_{formatted_country_name}_{buffer}_{simplify}.png"
-        try:
-            image_service.get_country_image(
-                filter_name,
-                formatted_country_name,
-                buffer,
-                simplify,
-            )
-        except CountryNotFoundException as exc:
-            logger.error(f"Error processing country {country_name}: {exc}")
-            continue
-        image_urls.append(storage_service.get_image_url(blob_name))
-
-    logger.info(f"Processed {image_urls} countries")
-    return image_urls
+    return await get_batch_urls("sovereignt", countries_names, buffer, simplify)
 
 
 @broker.task
 async def run_coutries_by_eco(
-    economies: str,
+    economies: list[str],
     buffer: float = 0.1,
     simplify: float = 0.01,
 ) -> list[str]:
@@ -71,27 +237,12 @@ async def run_coutries_by_eco(
     Task to get countries by economy.
     Returns the links of images created.
     """
-    image_urls = []
-    for i, economy in enumerate(economies):
-        filter_name = "economy"
-        blob_name = f"{filter_name}_{economy}_{buffer}_{simplify}.png"
-        try:
-            image_service.get_country_image(
-                filter_name,
-                economy,
-                buffer,
-                simplify,
-            )
-        except CountryNotFoundException as exc:
-            logger.error(f"Error processing country {economy}: {exc}")
-            continue
-        image_urls.append(storage_service.get_image_url(blob_name))
-    return image_urls
+    return await get_batch_urls("economy", economies, buffer, simplify)
 
 
 @broker.task
 async def run_coutries_by_income(
-    income_grps: str,
+    income_grps: list[str],
     buffer: float = 0.1,
     simplify: float = 0.01,
 ) -> list[str]:
@@ -99,19 +250,4 @@ async def run_coutries_by_income(
     Task to get countries by group name.
     Returns the links of images created.
     """
-    image_urls = []
-    for i, income_grp in enumerate(income_grps):
-        filter_name = "economy"
-        blob_name = f"{filter_name}_{income_grp}_{buffer}_{simplify}.png"
-        try:
-            image_service.get_country_image(
-                filter_name,
-                income_grp,
-                buffer,
-                simplify,
-            )
-        except CountryNotFoundException as exc:
-            logger.error(f"Error processing country {income_grp}: {exc}")
-            continue
-        image_urls.append(storage_service.get_image_url(blob_name))
-    return image_urls
+    return await get_batch_urls("income_grp", income_grps, buffer, simplify)
@@ -1,112 +1,397 @@
-from fastapi import APIRouter, Depends
-from typing import Annotated
-from showme.services.image import ImageService
+import asyncio
+import time
+import uuid
+from pathlib import Path
+
+import orjson
+from fastapi import APIRouter, Depends, Request
+from typing import Annotated, AsyncIterator, Literal
+from redis.asyncio import ConnectionPool
+from showme.services.redis import BatchProgress
+from showme.services.redis.dependency import get_redis_pool
+from showme.services.image import ImageServicePersisted
 from showme.web.dependencies import ImageServiceeMarker
-from starlette.responses import StreamingResponse, Response
-from showme.services.image import CountryNotFoundException
+from starlette.responses import (
+    FileResponse,
+    JSONResponse,
+    RedirectResponse,
+    StreamingResponse,
+    Response,
+)
+from showme.services.image import (
+    CountryNotFoundException,
+    ImageStream,
+    get_image_etag,
+)
+from showme.services.render import RenderQueueFullException
 from pydantic import BaseModel
 from fastapi import HTTPException
-from showme.tkq import run_coutries_by_name, run_coutries_by_eco, run_coutries_by_income
+from showme.tkq import broker, run_batch
 from starlette import status
+from showme.settings import ImageResponseMode, RenderEngineName, settings
 
 router = APIRouter()
 
+IMAGE_HEADERS = {"Content-Disposition": "attachment; filename=country.png"}
+
+# Columns filtered on by each kind of batch.
+BATCH_FILTERS = {
+    "country_name": "sovereignt",
+    "economy": "economy",
+    "group": "income_grp",
+}
+
 
 class StringList(BaseModel):
     filter_values: list[str]
 
 
-@router.get("/country_name/{country_name}")
-def get_country_by_name(
-    image_service: Annotated[ImageService, Depends(ImageServiceeMarker)],
-    country_name: str,
-    buffer: float = 0.1,
-    simplify: float = 0.01,
-) -> StreamingResponse:
-    formatted_country_name = country_name.lower().capitalize()
+class BatchItem(BaseModel):
+    filter_value: str
+    url: str | None = None
+    error: str | None = None
+
+
+class BatchJob(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "done", "failed"]
+    total: int
+    finished: int
+    items: list[BatchItem]
+    error: str | None = None
+
+
+def get_batch_progress(
+    redis_pool: Annotated[ConnectionPool, Depends(get_redis_pool)],
+) -> BatchProgress:
+    return BatchProgress(redis_pool, settings.batch_progress_ttl)
+
+
+async def get_batch_job(batch_progress: BatchProgress, job_id: str) -> BatchJob:
+    """
+    Reads the progress of a batch job, and its result once it's finished.
+
+    Items are in the order they were done while the job runs,
+    then in the order they were queued in.
+    """
+    total, items = await batch_progress.get(job_id)
+    if total is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown batch job {job_id}",
+        )
+    job_status = "running" if items else "queued"
+    error = None
+    if await broker.result_backend.is_result_ready(job_id):
+        result = await broker.result_backend.get_result(job_id)
+        if result.is_err:
+            job_status = "failed"
+            error = str(result.error)
+        else:
+            job_status = "done"
+            items = result.return_value
+    return BatchJob(
+        job_id=job_id,
+        status=job_status,
+        total=total,
+        finished=len(items),
+        items=items,
+        error=error,
+    )
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header matches an entity tag, weakly compared."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def get_not_modified_response(etag: str, headers: dict[str, str]) -> Response:
+    """Tells the client its copy of an image, by that entity tag, is current."""
+    return Response(
+        status_code=status.HTTP_304_NOT_MODIFIED,
+        headers={**headers, "ETag": etag},
+    )
+
+
+def get_url_response(url: str, response_mode: ImageResponseMode) -> Response:
+    """Redirects to an image's storage URL, or responds with it."""
+    # Signed URLs expire, so they mustn't outlive their signature in caches.
+    cache_control = settings.image_cache_control
+    if settings.azure_blob_sas_ttl is not None:
+        cache_control = "no-store"
+    headers = {"Cache-Control": cache_control}
+    if response_mode == ImageResponseMode.REDIRECT:
+        return RedirectResponse(url, status_code=status.HTTP_302_FOUND, headers=headers)
+    return JSONResponse({"url": url}, headers=headers)
+
+
+async def get_image_response(
+    request: Request,
+    image_service: ImageServicePersisted,
+    filter_name: str,
+    filter_value: str,
+    buffer: float,
+    simplify: float,
+    quad_segs: int | None,
+    engine: RenderEngineName | None,
+    response_mode: ImageResponseMode | None = None,
+) -> Response:
+    """
+    Responds with the image of a country filter.
+
+    Requests whose If-None-Match matches the image's entity tag get a 304.
+    The tag is looked up in the caches, then for conditional requests in
+    the digest the storage keeps along with the image, so the image isn't
+    fetched or rendered; otherwise it's checked again once the image is.
+    Outside of the stream mode, images already in the blob storage aren't
+    sent: the response redirects to their URL, or holds it. Otherwise
+    images in memory, or small enough to be read whole, are sent in one
+    piece, the ones in a local file are sent from it by the server, and
+    larger ones only in the blob storage are streamed from it chunk by
+    chunk.
+    """
     try:
-        image_buf = image_service.get_country_image(
-            "sovereignt",
-            formatted_country_name,
+        key = image_service.get_render_key(
+            filter_name,
+            filter_value,
             buffer,
             simplify,
+            quad_segs,
+            engine and engine.value,
         )
+        if_none_match = request.headers.get("if-none-match")
+        etag = await image_service.get_etag(key, stored=if_none_match is not None)
+        headers = {"Cache-Control": settings.image_cache_control}
+        if etag is not None and etag_matches(if_none_match, etag):
+            return get_not_modified_response(etag, headers)
+        response_mode = response_mode or settings.image_response_mode
+        if response_mode != ImageResponseMode.STREAM:
+            url = await image_service.get_image_url(key, settings.azure_blob_sas_ttl)
+            if url is not None:
+                return get_url_response(url, response_mode)
+        image = await image_service.open_image(key)
+        if isinstance(image, Path):
+            # Files would otherwise get a tag of their modification time.
+            etag = etag or await image_service.get_etag(key, stored=True)
+            if etag is not None:
+                if etag_matches(if_none_match, etag):
+                    return get_not_modified_response(etag, headers)
+                headers["ETag"] = etag
+            return FileResponse(
+                image,
+                status_code=status.HTTP_200_OK,
+                media_type="image/png",
+                headers={**headers, **IMAGE_HEADERS},
+            )
+        if isinstance(image, ImageStream):
+            etag = etag or image.etag
+            headers["Content-Length"] = str(image.size)
+            if etag is not None:
+                headers["ETag"] = etag
+            return StreamingResponse(
+                image.chunks,
+                status_code=status.HTTP_200_OK,
+                media_type="image/png",
+                headers={**headers, **IMAGE_HEADERS},
+            )
     except CountryNotFoundException as exc:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(exc))
-    return StreamingResponse(
-        image_buf,
+    except RenderQueueFullException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(exc),
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    etag = get_image_etag(image)
+    if etag_matches(if_none_match, etag):
+        return get_not_modified_response(etag, headers)
+    return Response(
+        image,
         status_code=status.HTTP_200_OK,
         media_type="image/png",
-        headers={"Content-Disposition": "attachment; filename=country.png"},
+        headers={**headers, **IMAGE_HEADERS, "ETag": etag},
+    )
+
+
+@router.get("/country_name/{country_name}")
+async def get_country_by_name(
+    request: Request,
+    image_service: Annotated[ImageServicePersisted, Depends(ImageServiceeMarker)],
+    country_name: str,
+    buffer: float = 0.1,
+    simplify: float = 0.01,
+    quad_segs: int | None = None,
+    engine: RenderEngineName | None = None,
+    response_mode: ImageResponseMode | None = None,
+) -> Response:
+    return await get_image_response(
+        request,
+        image_service,
+        "sovereignt",
+        country_name,
+        buffer,
+        simplify,
+        quad_segs,
+        engine,
+        response_mode,
     )
 
 
 @router.get("/economy/{economy}")
-def get_countries_by_economy(
-    image_service: Annotated[ImageService, Depends(ImageServiceeMarker)],
+async def get_countries_by_economy(
+    request: Request,
+    image_service: Annotated[ImageServicePersisted, Depends(ImageServiceeMarker)],
     economy: str,
     buffer: float = 0.1,
     simplify: float = 0.01,
-) -> StreamingResponse:
-    try:
-        image_buf = image_service.get_country_image(
-            "economy",
-            economy,
-            buffer,
-            simplify,
-        )
-    except CountryNotFoundException as exc:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(exc))
-    return StreamingResponse(
-        image_buf,
-        status_code=status.HTTP_200_OK,
-        media_type="image/png",
-        headers={"Content-Disposition": "attachment; filename=country.png"},
+    quad_segs: int | None = None,
+    engine: RenderEngineName | None = None,
+    response_mode: ImageResponseMode | None = None,
+) -> Response:
+    return await get_image_response(
+        request,
+        image_service,
+        "economy",
+        economy,
+        buffer,
+        simplify,
+        quad_segs,
+        engine,
+        response_mode,
     )
 
 
 @router.get("/income/{group}")
-def get_countries_by_income(
-    image_service: Annotated[ImageService, Depends(ImageServiceeMarker)],
+async def get_countries_by_income(
+    request: Request,
+    image_service: Annotated[ImageServicePersisted, Depends(ImageServiceeMarker)],
     group: str,
     buffer: float = 0.1,
     simplify: float = 0.01,
-) -> StreamingResponse:
-    try:
-        image_buf = image_service.get_country_image(
-            "income_grp",
-            group,
-            buffer,
-            simplify,
-        )
-    except CountryNotFoundException as exc:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(exc))
-    return StreamingResponse(
-        image_buf,
-        status_code=status.HTTP_200_OK,
-        media_type="image/png",
-        headers={"Content-Disposition": "attachment; filename=country.png"},
+    quad_segs: int | None = None,
+    engine: RenderEngineName | None = None,
+    response_mode: ImageResponseMode | None = None,
+) -> Response:
+    return await get_image_response(
+        request,
+        image_service,
+        "income_grp",
+        group,
+        buffer,
+        simplify,
+        quad_segs,
+        engine,
+        response_mode,
     )
 
 
 @router.post("/batch/{filter_by}")
 async def post_batch(
-    image_service: Annotated[ImageService, Depends(ImageServiceeMarker)],
+    batch_progress: Annotated[BatchProgress, Depends(get_batch_progress)],
     filter_by: str,
     filter_values: StringList,
+    buffer: float = 0.1,
+    simplify: float = 0.01,
+    quad_segs: int | None = None,
+    engine: RenderEngineName | None = None,
 ) -> Response:
-    if filter_by == "country_name":
-        for filter_value in filter_values:
-            await run_coutries_by_name.kiq(filter_value)
-    elif filter_by == "economy":
-        for filter_value in filter_values:
-            await run_coutries_by_eco.kiq(filter_value)
-    elif filter_by == "group":
-        for filter_value in filter_values:
-            await run_coutries_by_income.kiq(filter_value)
-    else:
+    """
+    Queues the rendering of a batch of filter values as a single job.
+
+    Responds with the job's ID, to follow it by.
+    """
+    filter_name = BATCH_FILTERS.get(filter_by)
+    if filter_name is None:
         raise HTTPException(
             status_code=400,
             detail="Invalid filter_by value, must be one of: country_name, economy, group",
         )
-    return Response(status_code=status.HTTP_201_CREATED)
+    job_id = uuid.uuid4().hex
+    await batch_progress.start(job_id, len(filter_values.filter_values))
+    await (
+        run_batch.kicker()
+        .with_task_id(job_id)
+        .kiq(
+            filter_name,
+            filter_values.filter_values,
+            buffer,
+            simplify,
+            quad_segs,
+            engine and engine.value,
+        )
+    )
+    return JSONResponse({"job_id": job_id}, status_code=status.HTTP_201_CREATED)
+
+
+@router.get("/batch/{job_id}")
+async def get_batch(
+    batch_progress: Annotated[BatchProgress, Depends(get_batch_progress)],
+    job_id: str,
+) -> BatchJob:
+    """
+    Reports the progress of a batch job, with the results of its done items.
+    """
+    return await get_batch_job(batch_progress, job_id)
+
+
+@router.get("/batch/{job_id}/events")
+async def get_batch_events(
+    request: Request,
+    batch_progress: Annotated[BatchProgress, Depends(get_batch_progress)],
+    job_id: str,
+) -> StreamingResponse:
+    """
+    Streams the results of a batch job's items as Server-Sent Events.
+
+    An "item" event is sent as soon as each item is done, then a "done"
+    event with the job's final status. Item events are numbered, so a
+    reconnecting client's Last-Event-ID resumes the stream after them.
+    The stream ends with an "error" event instead if the job's progress
+    expires, or if none of its items is done for too long, as happens
+    when its message is lost.
+    """
+    total, _ = await batch_progress.get(job_id)
+    if total is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Unknown batch job {job_id}",
+        )
+    last_event_id = request.headers.get("last-event-id", "")
+    sent = int(last_event_id) if last_event_id.isdigit() else 0
+
+    def error_event(detail: str) -> str:
+        return f"event: error\ndata: {orjson.dumps({'detail': detail}).decode()}\n\n"
+
+    async def events() -> AsyncIterator[str]:
+        nonlocal sent
+        progressed_at = time.monotonic()
+        while True:
+            # Checked first, so the items read next include all of a done job's.
+            done = await broker.result_backend.is_result_ready(job_id)
+            total, items = await batch_progress.get(job_id, sent)
+            if total is None:
+                yield error_event(f"Batch job {job_id} expired")
+                return
+            for item in items:
+                sent += 1
+                yield f"id: {sent}\nevent: item\ndata: {orjson.dumps(item).decode()}\n\n"
+            if done:
+                job = await get_batch_job(batch_progress, job_id)
+                data = job.model_dump_json(exclude={"items"})
+                yield f"event: done\ndata: {data}\n\n"
+                return
+            if items:
+                progressed_at = time.monotonic()
+            elif time.monotonic() - progressed_at > settings.batch_events_idle_timeout:
+                yield error_event(f"Batch job {job_id} made no progress")
+                return
+            await asyncio.sleep(settings.batch_events_poll_interval)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
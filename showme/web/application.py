@@ -1,13 +1,15 @@
 from fastapi import FastAPI
 from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 from showme.services.image import ImageServicePersisted
-from showme.services.blob import ImageStorageService
+from showme.services.blob.factory import build_storage_service
+from showme.services.image.factory import build_image_service
 from showme.web.dependencies import ImageServiceeMarker
 from showme.log import configure_logging
 from showme.web.api.router import api_router
 from showme.web.lifetime import register_shutdown_event, register_startup_event
-from showme.settings import settings
+from showme.settings import StorageBackend, settings
 
 
 def get_app() -> FastAPI:
@@ -39,11 +41,9 @@ def get_app() -> FastAPI:
     # Adds startup and shutdown events.
     register_startup_event(app)
     register_shutdown_event(app)
-    storage_service = ImageStorageService(
-        settings.azure_blob_connection_string,
-        settings.azure_blob_container_name,
-    )
-    image_service = ImageServicePersisted(storage_service=storage_service)
+    storage_service = build_storage_service()
+    image_service = build_image_service(storage_service)
+    app.state.image_service = image_service
 
     def get_image_service() -> ImageServicePersisted:
         return image_service
@@ -55,5 +55,12 @@ def get_app() -> FastAPI:
     )
     # Main router for the API.
     app.include_router(router=api_router, prefix="/api")
+    # Images of the local storage, which their URLs point to.
+    if settings.storage_backend == StorageBackend.LOCAL:
+        app.mount(
+            settings.local_storage_url,
+            StaticFiles(directory=settings.local_storage_path, check_dir=False),
+            name="images",
+        )
 
     return app
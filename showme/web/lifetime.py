@@ -19,8 +19,21 @@ from prometheus_fastapi_instrumentator.instrumentation import (
 )
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
+from showme.services.blob.lifetime import (
+    init_blob_manifest,
+    init_upload_queue,
+    shutdown_blob_manifest,
+    shutdown_storage,
+    shutdown_upload_queue,
+)
+from showme.services.cache.lifetime import init_shared_image_cache
 from showme.services.kafka.lifetime import init_kafka, shutdown_kafka
 from showme.services.redis.lifetime import init_redis, shutdown_redis
+from showme.services.render.lifetime import (
+    init_render_executor,
+    init_render_lease,
+    shutdown_render_executor,
+)
 from showme.settings import settings
 from showme.tkq import broker
 
@@ -143,7 +156,15 @@ def register_startup_event(
         _setup_db(app)
         setup_opentelemetry(app)
         init_redis(app)
+        init_render_lease(app)
+        init_shared_image_cache(app)
         await init_kafka(app)
+        # Taskiq workers render and persist with services of their own,
+        # see showme.tkq, the application's would only sit idle there.
+        if not broker.is_worker_process:
+            await init_render_executor(app)
+            await init_blob_manifest(app)
+            await init_upload_queue(app)
         setup_prometheus(app)
         app.middleware_stack = app.build_middleware_stack()
         pass  # noqa: WPS420
@@ -169,6 +190,11 @@ def register_shutdown_event(
 
         await shutdown_redis(app)
         await shutdown_kafka(app)
+        if not broker.is_worker_process:
+            await shutdown_render_executor(app)
+            await shutdown_upload_queue(app)
+            await shutdown_blob_manifest(app)
+            await shutdown_storage(app)
         stop_opentelemetry(app)
         pass  # noqa: WPS420
 